@@ -0,0 +1,363 @@
+import copy
+import inspect
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from sqlalchemy import select, insert, update, delete, func
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.exc import IntegrityError
+from database import User, UserChange, TokenRevocation, PasswordOTP, AsyncSession, async_read_replicas, begin_write
+from replicas import REPLICA_ERRORS
+from settings import Settings
+from user_cache import user_cache
+from crud import (DuplicateUserError, violated_field, conflict_query, pick_conflict, update_values,
+                  existing_values_query, collect_unique_values, list_query, page_with_cursor,
+                  consume_otp_query, otp_failure, remembered_user_id, remember_user, forget_users, invalidate_after_commit,
+                  LIVE, live, delete_users_query, change_rows, log_changes_query, revocations_query, changes_query,
+                  users_version_query, format_version)
+
+# Buffered rows of a statement; used as an AsyncCRUD._read query
+async def all_rows(session, statement):
+    return (await session.execute(statement)).all()
+
+# Awaits AsyncCRUD methods directly and runs blocking CRUD methods in the threadpool
+async def call_db(method, *args, **kwargs):
+    if inspect.iscoroutinefunction(method):
+        return await method(*args, **kwargs)
+    return await run_in_threadpool(method, *args, **kwargs)
+
+class AsyncCRUD:
+    """Same API as CRUD, but every method is a coroutine running on an AsyncSession."""
+    User = User  #Reference to the User model
+
+    def __init__(self, session_factory=None, session=None):
+        self.Session = session_factory or AsyncSession
+        # Session of the unit of work this CRUD is bound to (see bind); None opens a session per call
+        self.session = session
+        self.replicas = async_read_replicas
+        self.user_cache = user_cache
+
+    # Copy of this CRUD running every call on the given session (unit_of_work.UnitOfWork)
+    def bind(self, session):
+        bound = copy.copy(self)
+        bound.session = session
+        return bound
+
+    # The bound session, or a new one closed at the end of the block
+    @asynccontextmanager
+    async def _session(self):
+        if self.session is not None:
+            yield self.session
+        else:
+            async with self.Session() as session:
+                yield session
+
+    # Transaction for a write. Unbound it is committed at the end of the block; bound it is a savepoint
+    # of the request transaction, so a failed write is undone without losing the rest of the request
+    @asynccontextmanager
+    async def _transaction(self):
+        if self.session is None:
+            async with self.Session() as session, session.begin():
+                yield session
+            return
+        await self.session.run_sync(begin_write)
+        try:
+            async with self.session.begin_nested():
+                yield self.session
+        finally:
+            forget_users(self.session)
+
+    # Drop changed users from the user cache, after the commit when bound to a unit of work
+    def _invalidate(self, user_ids):
+        if self.session is not None:
+            invalidate_after_commit(self.session, user_ids)
+            return
+        for user_id in user_ids:
+            self.user_cache.invalidate(user_id)
+
+    # Await query(session) on a read replica. consistent=True (read-your-writes) reads from the primary,
+    # as does any read while no replica is healthy or after the chosen replica fails
+    async def _read(self, query, consistent: bool = False):
+        replica = None if consistent else self.replicas.pick()
+        if replica is not None:
+            started = time.perf_counter()
+            try:
+                async with replica.Session() as session:
+                    result = await query(session)
+            except REPLICA_ERRORS as error:
+                self.replicas.mark_down(replica, error)
+            else:
+                self.replicas.observe(replica, time.perf_counter() - started)
+                return result
+        async with self._session() as session:
+            return await query(session)
+
+    # Add new user
+    async def add(self, first_name, last_name, username, email, mobile, password, security_question, security_answer,created_at, updated_at, created_by, updated_by):
+        try:
+            async with self._transaction() as session:
+                user = self.User(
+                    first_name=first_name,
+                    last_name=last_name,
+                    username=username,
+                    email=email,
+                    mobile=mobile,
+                    password=password,
+                    security_question=security_question,
+                    security_answer=security_answer,
+                    created_at=created_at,
+                    updated_at=updated_at,
+                    created_by=created_by,
+                    updated_by=updated_by
+                )
+                session.add(user)
+                await session.flush()
+                await session.execute(insert(UserChange), change_rows([user.id], "create", changed_by=created_by))
+        except IntegrityError as e:
+            raise DuplicateUserError(await self._conflict(e, username, email, mobile))
+
+    # Update user by id in a single UPDATE; returns False when the user does not exist
+    async def update(self, id, first_name, last_name, username, email, mobile, password=None, security_question=None, security_answer=None,updated_at=None, updated_by=None):
+        values = update_values(first_name, last_name, username, email, mobile, password, security_question,
+                               security_answer, updated_at, updated_by)
+        try:
+            async with self._transaction() as session:
+                result = await session.execute(update(self.User).where(self.User.id == id, LIVE).values(**values))
+                if result.rowcount:
+                    await session.execute(insert(UserChange), change_rows([id], "update", values, updated_by))
+        except IntegrityError as e:
+            raise DuplicateUserError(await self._conflict(e, username, email, mobile, exclude_id=id))
+        self._invalidate([id])
+        return result.rowcount > 0
+
+    # Delete user by id
+    async def delete(self, id, deleted_by: str = None):
+        return await self.delete_users([id], deleted_by=deleted_by) > 0
+
+    # Delete users in one statement, soft or hard depending on DELETE_MODE; returns how many were deleted
+    async def delete_users(self, user_ids, mode: str = Settings.DELETE_MODE, deleted_by: str = None) -> int:
+        async with self._transaction() as session:
+            await session.execute(log_changes_query("delete", [self.User.id.in_(user_ids), LIVE], deleted_by))
+            result = await session.execute(delete_users_query(user_ids, datetime.now(), mode))
+        self._invalidate(user_ids)
+        return result.rowcount
+
+    # Hard-delete up to batch_size users soft-deleted before cutoff; returns how many were removed
+    async def purge_deleted(self, cutoff, batch_size: int = 500) -> int:
+        async with self._transaction() as session:
+            result = await session.scalars(select(self.User.id).where(self.User.deleted_at <= cutoff)
+                                           .limit(batch_size))
+            ids = result.all()
+            if ids:
+                await session.execute(delete(self.User).where(self.User.id.in_(ids)))
+                await session.execute(delete(PasswordOTP).where(PasswordOTP.user_id.in_(ids)))
+                await session.execute(insert(UserChange), change_rows(ids, "purge"))
+        return len(ids)
+
+    # Show all users
+    async def show_all(self, consistent: bool = False):
+        async def query(session):
+            return (await session.scalars(select(self.User).where(LIVE))).all()
+        return await self._read(query, consistent)
+
+    # Version of the users table (see crud.users_version_query)
+    async def users_version(self) -> str:
+        async def query(session):
+            return format_version((await session.execute(users_version_query())).one())
+        return await self._read(query)
+
+    # One page of users for the list view, filtered and sorted in the database (keyset pagination).
+    # Returns (rows, next cursor, users_version). The version is read first on the same database as
+    # the rows, so it never names newer data than the page holds
+    async def list_page(self, cursor: str = None, limit: int = 50, filters: dict = None, sort: str = "id", descending: bool = False):
+        statement = list_query(self.list_columns(), cursor, limit, filters, sort, descending)
+        async def read(session):
+            version = format_version((await session.execute(users_version_query())).one())
+            return version, await all_rows(session, statement)
+        version, rows = await self._read(read)
+        return page_with_cursor(rows, limit, sort) + (version,)
+
+    # Columns shown in the users list (no password, OTP or security answer)
+    def list_columns(self):
+        return (self.User.id, self.User.first_name, self.User.last_name,
+                self.User.username, self.User.email, self.User.mobile)
+
+    # Columns written by the export (no password, OTP or security answer)
+    def export_columns(self):
+        return self.list_columns() + (self.User.created_at, self.User.updated_at,
+                                      self.User.created_by, self.User.updated_by)
+
+    # Stream users for export from a server-side cursor, batch_size rows at a time. The stream
+    # outlives the request, so it always runs on a session of its own
+    async def iter_export(self, batch_size: int = 1000):
+        async with self.Session() as session:
+            query = select(*self.export_columns()).where(LIVE).order_by(self.User.id)
+            result = await session.stream(query.execution_options(yield_per=batch_size))
+            async for row in result:
+                yield row
+
+    # Unique values already present for a batch of candidate users (one query)
+    async def existing_unique_values(self, usernames, emails, mobiles, consistent: bool = False):
+        statement = existing_values_query(usernames, emails, mobiles)
+        rows = await self._read(lambda session: all_rows(session, statement), consistent)
+        return collect_unique_values(rows)
+
+    # Insert many users in one transaction (executemany); the whole batch fails on a duplicate
+    async def bulk_add(self, rows):
+        try:
+            async with self._transaction() as session:
+                await session.execute(insert(self.User), rows)
+                usernames = [row["username"] for row in rows]
+                await session.execute(log_changes_query("create", [self.User.username.in_(usernames)],
+                                                        self.User.created_by))
+        except IntegrityError:
+            raise DuplicateUserError()
+        return len(rows)
+
+    # Find by email
+    async def get_user_by_email(self, email: str, consistent: bool = False):
+        return await self._first(self.User.email, email, consistent)
+
+    # Find by username (for login)
+    async def get_user_by_username(self, username: str, consistent: bool = False):
+        return await self._first(self.User.username, username, consistent)
+
+    # Read-only snapshot of the logged-in user, served from the user cache when possible
+    async def get_cached_user(self, username: str):
+        snapshot = self.user_cache.get(username)
+        if snapshot is not None:
+            return snapshot
+        user = await self.get_user_by_username(username)
+        if user is None:
+            return None
+        return self.user_cache.put(user)
+
+    # Find by mobile
+    async def get_user_by_mobile(self, mobile: str, consistent: bool = False):
+        return await self._first(self.User.mobile, mobile, consistent)
+
+    # Find by id
+    async def get_user_by_id(self, user_id: int, consistent: bool = False):
+        async def query(session):
+            return live(await session.get(self.User, user_id))
+        return await self._read(query, consistent)
+
+    async def update_password(self, user_id: int, new_password: str):
+        async with self._transaction() as session:
+            user = live(await session.get(self.User, user_id))
+            if user:
+                user.password = new_password
+                await session.execute(insert(UserChange), change_rows([user_id], "update", ["password"]))
+        if user:
+            self._invalidate([user_id])
+            return True
+        return False
+
+    async def update_otp(self, user_id: int, otp: str, otp_expiry=None):
+        async with self._transaction() as session:
+            user = live(await session.get(self.User, user_id))
+            if user:
+                user.otp = otp
+                user.otp_expiry = otp_expiry
+                await session.execute(insert(UserChange), change_rows([user_id], "update", ["otp", "otp_expiry"]))
+        return user is not None
+
+    # Unique field (username, email or mobile) already taken by another user, checked in one query
+    async def find_conflict(self, username, email, mobile, exclude_id=None, consistent: bool = False):
+        statement = conflict_query(username, email, mobile, exclude_id)
+        rows = await self._read(lambda session: all_rows(session, statement), consistent)
+        return pick_conflict(rows, username, email, mobile)
+
+    # Which unique field a failed write collided with
+    async def _conflict(self, error, username, email, mobile, exclude_id=None):
+        field = violated_field(error)
+        if field is None:
+            field = await self.find_conflict(username, email, mobile, exclude_id, consistent=True)
+        return field
+
+    # Persist a token revocation so other workers pick it up
+    async def add_revocation(self, expires_at: float, jti: str = None, user_id: int = None, revoked_before: float = None):
+        async with self._transaction() as session:
+            session.add(TokenRevocation(jti=jti, user_id=user_id, revoked_before=revoked_before, expires_at=expires_at))
+
+    # Revoke the tokens of several users in one INSERT
+    async def add_user_revocations(self, user_ids, revoked_before: float, expires_at: float):
+        async with self._transaction() as session:
+            await session.execute(insert(TokenRevocation), [{"user_id": user_id, "revoked_before": revoked_before,
+                                                             "expires_at": expires_at} for user_id in user_ids])
+
+    # Revocations recorded after the given id that have not expired yet
+    async def revocations_since(self, last_id: int, now: float, missing_ids=()):
+        async with self._session() as session:
+            result = await session.execute(revocations_query(last_id, now, missing_ids))
+            return result.all()
+
+    # Change-log rows after the given id or among missing_ids (see changes_query); read from the primary
+    async def changes_since(self, after_id: int, limit: int, missing_ids=()):
+        async with self._session() as session:
+            return (await session.execute(changes_query(after_id, limit, missing_ids))).all()
+
+    # Delete up to batch_size change-log rows recorded before cutoff; returns how many were removed
+    async def purge_changes(self, cutoff, batch_size: int = 1000) -> int:
+        async with self._transaction() as session:
+            result = await session.scalars(select(UserChange.id).where(UserChange.changed_at < cutoff)
+                                           .limit(batch_size))
+            ids = result.all()
+            if ids:
+                await session.execute(delete(UserChange).where(UserChange.id.in_(ids)))
+        return len(ids)
+
+    # Id of the newest change-log row, 0 when there is none
+    async def last_change_id(self) -> int:
+        async with self._session() as session:
+            return (await session.scalar(select(func.max(UserChange.id)))) or 0
+
+    # Remove revocations whose tokens have expired anyway
+    async def purge_revocations(self, now: float):
+        async with self._transaction() as session:
+            await session.execute(delete(TokenRevocation).where(TokenRevocation.expires_at <= now))
+
+    # Store a user's OTP, replacing any pending one
+    async def issue_otp(self, user_id: int, otp: str, expires_at):
+        async with self._transaction() as session:
+            await session.merge(PasswordOTP(user_id=user_id, otp=otp, expires_at=expires_at, attempts=0))
+
+    # Verify and consume an OTP in one DELETE; returns "ok", "invalid", "expired" or "locked"
+    async def consume_otp(self, user_id: int, otp: str, now, max_attempts: int) -> str:
+        async with self._transaction() as session:
+            result = await session.execute(consume_otp_query(user_id, otp, now, max_attempts))
+            if result.rowcount == 1:
+                return "ok"
+            await session.execute(update(PasswordOTP).where(PasswordOTP.user_id == user_id)
+                                  .values(attempts=PasswordOTP.attempts + 1))
+            status = otp_failure(await session.get(PasswordOTP, user_id), otp, now, max_attempts)
+            if status != "invalid":
+                await session.execute(delete(PasswordOTP).where(PasswordOTP.user_id == user_id))
+            return status
+
+    # Delete up to batch_size expired OTPs; returns how many were removed
+    async def purge_otps(self, now, batch_size: int = 1000) -> int:
+        async with self._transaction() as session:
+            result = await session.scalars(select(PasswordOTP.user_id).where(PasswordOTP.expires_at <= now)
+                                           .limit(batch_size))
+            ids = result.all()
+            if ids:
+                await session.execute(delete(PasswordOTP).where(PasswordOTP.user_id.in_(ids)))
+        return len(ids)
+
+    async def save(self, user):
+        async with self._transaction() as session:
+            await session.merge(user)
+            await session.execute(insert(UserChange), change_rows([user.id], "update"))
+        self._invalidate([user.id])
+
+    # User whose unique column equals value; a bound AsyncCRUD answers repeated lookups from its identity map
+    async def _first(self, column, value, consistent: bool = False):
+        if self.session is not None:
+            user_id = remembered_user_id(self.session, column, value)
+            if user_id is not None:
+                return live(await self.session.get(self.User, user_id))
+        user = await self._read(lambda session: session.scalar(select(self.User).where(column == value, LIVE).limit(1)), consistent)
+        if user is not None and self.session is not None and user in self.session:
+            remember_user(self.session, column, value, user)
+        return user
@@ -0,0 +1,265 @@
+"""
+In-process load test for every route and the CRUD class.
+
+Runs the FastAPI app through httpx's ASGI transport against a throwaway SQLite
+database (or the URL given with --database-url), seeds --users accounts through
+CRUD.add and then drives login, /home, add, update, delete and the
+forgot-password/OTP flow at the requested concurrency. Per route it reports
+p50/p95/p99 latency, throughput, SQL statements and connection pool checkouts
+per request, and writes the numbers as JSON so runs can be compared:
+
+    python benchmarks/bench_app.py --users 1000 --requests 200 --concurrency 16 --output baseline.json
+    python benchmarks/bench_app.py --compare baseline.json
+
+Requires a passkey.py (see README) on the import path.
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ROUTES = ("login", "home", "add", "update", "delete", "forgot_password")
+PASSWORD = "bench123"
+
+# [SQL statements, pool checkouts] of the request being handled
+current_queries = contextvars.ContextVar("current_queries", default=None)
+
+
+def configure_environment(args):
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        path = os.path.join(tempfile.mkdtemp(prefix="bench_app_"), "bench.db")
+        os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+        os.environ.setdefault("ASYNC_DATABASE_URL", f"sqlite+aiosqlite:///{path}")
+    os.environ["DB_BACKEND"] = args.backend
+    os.environ["EMAIL_BACKEND"] = "memory"
+    # Every benchmark request comes from one client; keep the brute-force limits out of the numbers
+    for name in ("LOGIN", "FORGOT", "OTP"):
+        os.environ[f"RATE_LIMIT_{name}_IP"] = os.environ[f"RATE_LIMIT_{name}_IDENTIFIER"] = "1000000/1"
+    os.chdir(ROOT)
+
+
+def count_queries(engine):
+    from sqlalchemy import event
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter = current_queries.get()
+        if counter is not None:
+            counter[0] += 1
+
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        counter = current_queries.get()
+        if counter is not None:
+            counter[1] += 1
+
+    engine = getattr(engine, "sync_engine", engine)
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "checkout", checkout)
+
+
+def seed_users(count: int):
+    from crud import CRUD
+    from hashing import pwd_context
+    db = CRUD()
+    hashed = pwd_context.hash(PASSWORD)
+    now = datetime.now()
+    for i in range(count):
+        db.add("Bench", "User", f"bench{i:06d}", f"bench{i}@example.com", f"7{i:09d}", hashed,
+               "q", "a", now, now, "bench", "bench")
+
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Runner:
+    def __init__(self, client, users: int):
+        self.client = client
+        self.users = users
+        self.added = []
+        self.sequence = 0
+
+    def next_id(self) -> int:
+        self.sequence += 1
+        return self.sequence
+
+    async def login(self, i):
+        username = f"bench{i % self.users:06d}"
+        return await self.client.post("/login", data={"username": username, "password": PASSWORD})
+
+    async def home(self, i):
+        return await self.client.get("/home")
+
+    async def add(self, i):
+        n = self.next_id()
+        response = await self.client.post("/add", data={
+            "first_name": "Added", "last_name": "User", "username": f"added{n:06d}",
+            "email": f"added{n}@example.com", "mobile": f"6{n:09d}", "password": PASSWORD,
+            "security_question": "q", "security_answer": "a"})
+        self.added.append(f"added{n:06d}")
+        return response
+
+    async def update(self, i):
+        user_id = i % max(self.users - 1, 1) + 2  # seeded ids 2..users; id 1 is the logged-in user
+        return await self.client.post(f"/update/{user_id}", data={
+            "first_name": "Updated", "last_name": "User", "username": f"bench{user_id - 1:06d}",
+            "email": f"bench{user_id - 1}@example.com", "mobile": f"7{user_id - 1:09d}"})
+
+    async def delete(self, i):
+        user_id = self.users + 1 + i  # rows created by the add phase
+        return await self.client.get(f"/delete/{user_id}")
+
+    async def forgot_password(self, i):
+        from smtp_utils import MemoryTransport
+        index = i % self.users
+        email = f"bench{index}@example.com"
+        sent = len(MemoryTransport.outbox)
+        response = await self.client.post("/forgot-password", data={
+            "option": "email", "identifier": email, "security_question": "q", "security_answer": "a"})
+        otp = await self.wait_for_otp(email, sent)
+        if otp is None:
+            return response
+        return await self.client.post("/verify-otp", data={"option": "email", "identifier": email, "otp": otp})
+
+    async def wait_for_otp(self, email: str, start: int, timeout: float = 5.0):
+        from smtp_utils import MemoryTransport
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            for message in MemoryTransport.outbox[start:]:
+                if message["to"] == email:
+                    match = re.search(r"\b(\d{6})\b", message["body"])
+                    return match.group(1) if match else None
+            await asyncio.sleep(0.005)
+        return None
+
+
+async def run_route(runner, name: str, requests: int, concurrency: int) -> dict:
+    action = getattr(runner, name)
+    latencies, queries, checkouts, errors = [], [], [], 0
+    jobs = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in jobs:
+            counter = [0, 0]
+            token = current_queries.set(counter)
+            started = time.perf_counter()
+            try:
+                response = await action(i)
+                if response.status_code >= 400:
+                    errors += 1
+            except Exception:
+                errors += 1
+            finally:
+                latencies.append(time.perf_counter() - started)
+                queries.append(counter[0])
+                checkouts.append(counter[1])
+                current_queries.reset(token)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "queries_per_request": round(statistics.mean(queries), 2) if queries else 0.0,
+        "checkouts_per_request": round(statistics.mean(checkouts), 2) if checkouts else 0.0,
+    }
+
+
+async def run(args) -> dict:
+    import httpx
+    import database
+    import main
+
+    database.create_schema()
+    count_queries(database.engine)
+    if database.async_engine is not None:
+        count_queries(database.async_engine)
+    seed_users(args.users)
+
+    app = main.create_app()
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            runner = Runner(client, args.users)
+            response = await runner.login(0)
+            client.cookies.set("access_token", response.cookies["access_token"])
+            results = {}
+            for name in args.routes:
+                if name == "delete":
+                    # Only delete what the add phase created
+                    requests = min(args.requests, len(runner.added))
+                else:
+                    requests = args.requests
+                results[name] = await run_route(runner, name, requests, args.concurrency)
+                print(format_row(name, results[name]))
+    return {"benchmark": "app", "backend": args.backend, "users": args.users,
+            "concurrency": args.concurrency, "routes": results}
+
+
+def format_row(name: str, result: dict) -> str:
+    return (f"{name:>16} {result['requests']:>8} {result['errors']:>6} {result['throughput_rps']:>10} "
+            f"{result['p50_ms']:>9} {result['p95_ms']:>9} {result['p99_ms']:>9} {result['queries_per_request']:>8} "
+            f"{result.get('checkouts_per_request', 0.0):>9}")
+
+
+def compare(current: dict, baseline: dict):
+    print("\nChange against baseline (positive = slower / more queries or checkouts):")
+    for name, result in current["routes"].items():
+        before = baseline.get("routes", {}).get(name)
+        if not before:
+            continue
+        changes = []
+        for key in ("p50_ms", "p95_ms", "p99_ms", "queries_per_request", "checkouts_per_request"):
+            if before.get(key):
+                changes.append(f"{key} {(result[key] - before[key]) / before[key] * 100:+.1f}%")
+        print(f"{name:>16} " + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process load test for routes and CRUD")
+    parser.add_argument("--users", type=int, default=1000, help="users seeded before the run")
+    parser.add_argument("--requests", type=int, default=100, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--routes", nargs="+", choices=ROUTES, default=list(ROUTES))
+    parser.add_argument("--backend", choices=("sync", "async"), default="sync")
+    parser.add_argument("--database-url", help="disposable database to use instead of a temporary SQLite file")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    args = parser.parse_args()
+    if "delete" in args.routes and "add" not in args.routes:
+        parser.error("the delete route needs the add route to create rows")
+
+    configure_environment(args)
+    print(f"{'route':>16} {'requests':>8} {'errors':>6} {'req/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8} {'checkouts':>9}")
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Worker boot cost benchmark.
+
+Starts --runs fresh interpreters, like uvicorn/gunicorn workers, and reports how long
+each takes to import main and to run the startup (lifespan) hooks. It also reports how
+many DB connections each step opens. Importing should open none; startup opens what
+the revocation sync needs.
+
+    python benchmarks/bench_boot.py [--runs 5] [--backend sync|async] [--json out.json]
+
+Requires a passkey.py (see README) on the import path.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Runs in each child interpreter and prints one JSON line
+PROBE = """
+import asyncio, json, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+from pool_metrics import pool_metrics
+connects_at_import = pool_metrics.stats()["connects"]
+
+async def boot():
+    async with main.app.router.lifespan_context(main.app):
+        return time.perf_counter(), pool_metrics.stats()["connects"]
+
+ready, connects = asyncio.run(boot())
+print(json.dumps({"import_ms": (imported - start) * 1000, "startup_ms": (ready - imported) * 1000,
+                  "connects_at_import": connects_at_import, "connects_at_startup": connects - connects_at_import}))
+"""
+
+METRICS = ("import_ms", "startup_ms", "connects_at_import", "connects_at_startup")
+
+
+def configure_environment(args) -> dict:
+    env = dict(os.environ)
+    if args.database_url:
+        env["DATABASE_URL"] = args.database_url
+    else:
+        path = os.path.join(tempfile.mkdtemp(prefix="bench_boot_"), "boot.db")
+        env["DATABASE_URL"] = f"sqlite:///{path}"
+        env.setdefault("ASYNC_DATABASE_URL", f"sqlite+aiosqlite:///{path}")
+    env["DB_BACKEND"] = args.backend
+    env["EMAIL_BACKEND"] = "memory"
+    return env
+
+
+def create_schema(env: dict):
+    subprocess.run([sys.executable, "manage.py", "create-schema"], cwd=ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def boot_once(env: dict) -> dict:
+    output = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker import and startup cost")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--backend", choices=("sync", "async"), default="sync")
+    parser.add_argument("--database-url", help="migrated database to use instead of a temporary SQLite file")
+    parser.add_argument("--json", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    env = configure_environment(args)
+    if not args.database_url:
+        create_schema(env)
+    runs = [boot_once(env) for _ in range(args.runs)]
+    results = {key: {"median": round(statistics.median(run[key] for run in runs), 2),
+                     "max": round(max(run[key] for run in runs), 2)} for key in METRICS}
+
+    print(f"{'metric':>20} {'median':>10} {'max':>10}")
+    for key in METRICS:
+        print(f"{key:>20} {results[key]['median']:>10} {results[key]['max']:>10}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"benchmark": "boot", "backend": args.backend, "runs": args.runs, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Render-time benchmark for the users list page.
+
+Renders home.html with 1k/10k/100k fake users, both as one string (render) and
+streamed in chunks (generate), and reports time, bytes and time to first chunk.
+
+    python benchmarks/bench_render.py [--sizes 1000 10000 100000] [--repeat 3] [--json out.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from rendering import build_environment, STREAM_CHUNK_SIZE  # noqa: E402
+
+Row = namedtuple("Row", "id first_name last_name username email mobile")
+
+
+def fake_users(count: int):
+    return [Row(i, "First", "Last", f"user{i:06d}", f"user{i}@example.com", f"{9000000000 + i}")
+            for i in range(1, count + 1)]
+
+
+def page_context(users):
+    return {
+        "request": SimpleNamespace(url=SimpleNamespace(path="/home")),
+        "users": users,
+        "current_user": SimpleNamespace(first_name="Bench", last_name="User"),
+        "size": len(users),
+        "filters": {},
+        "sort": "id",
+        "order": "asc",
+        "sort_options": ["id"],
+        "first_url": None,
+        "next_url": None,
+    }
+
+
+def bench_render(template, context, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        html = template.render(context)
+        best = min(best, time.perf_counter() - started)
+    return best, len(html.encode())
+
+
+def bench_generate(template, context, repeat: int):
+    best_total = best_first = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        first = None
+        size = 0
+        for piece in template.generate(context):
+            size += len(piece)
+            if first is None and size >= STREAM_CHUNK_SIZE:
+                first = time.perf_counter() - started
+        total = time.perf_counter() - started
+        best_total = min(best_total, total)
+        best_first = min(best_first, first if first is not None else total)
+    return best_total, best_first
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    env = build_environment(os.path.join(ROOT, "templates"), auto_reload=False)
+    template = env.get_template("home.html")
+    results = []
+    print(f"{'users':>8} {'render ms':>10} {'bytes':>12} {'generate ms':>12} {'first chunk ms':>15}")
+    for count in args.sizes:
+        context = page_context(fake_users(count))
+        render_seconds, size = bench_render(template, context, args.repeat)
+        generate_seconds, first_chunk_seconds = bench_generate(template, context, args.repeat)
+        result = {
+            "users": count,
+            "render_ms": round(render_seconds * 1000, 2),
+            "bytes": size,
+            "generate_ms": round(generate_seconds * 1000, 2),
+            "first_chunk_ms": round(first_chunk_seconds * 1000, 2),
+        }
+        results.append(result)
+        print(f"{count:>8} {result['render_ms']:>10} {size:>12} {result['generate_ms']:>12} {result['first_chunk_ms']:>15}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"benchmark": "render_home", "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
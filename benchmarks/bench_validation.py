@@ -0,0 +1,122 @@
+"""
+Form validation benchmark.
+
+Validates --records user records with the previous per-field validators (re.match with
+the pattern looked up each call, HTTPException on the first error) and with the compiled
+Schema, one record at a time and as a batch (validate_many), and reports ns per record.
+Runs with all-valid records and with a mix where --invalid percent have several bad fields.
+
+    python benchmarks/bench_validation.py [--records 100000] [--invalid 30] [--repeat 3] [--json out.json]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+from fastapi import HTTPException
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from validation import USER_FORM  # noqa: E402
+
+
+# The validators as they were before the Schema, kept here as the baseline
+def legacy_name(name):
+    if not (2 <= len(name) <= 20):
+        raise HTTPException(status_code=400, detail="It must be 2-20 characters long")
+    if not re.match(r"^[A-Za-z]+$", name):
+        raise HTTPException(status_code=400, detail="It can only contain letters")
+    return name
+
+def legacy_password(password):
+    if not (6 <= len(password) <= 20):
+        raise HTTPException(status_code=400, detail="Password must be between 8-15 characters")
+    if not re.match(r"^(?=.*[A-Za-z])(?=.*\d)[A-Za-z\d@$!%*#?&]{6,20}$", password):
+        raise HTTPException(status_code=400, detail="Password must be 6-20 characters, include letters and numbers.")
+    return password
+
+def legacy_mobile(mobile):
+    if not re.match(r"^[0-9]{10}$", mobile):
+        raise HTTPException(status_code=400, detail="Mobile number must be exactly 10 digits.")
+    return mobile
+
+def legacy_username(username):
+    if not (5 <= len(username) <= 15):
+        raise HTTPException(status_code=400, detail="Username must be between 5-15 characters.")
+    if not re.match(r"^[A-Za-z0-9_]+$", username):
+        raise HTTPException(status_code=400, detail="Username can only contain letters, numbers, and underscores.")
+    return username
+
+def legacy_email(email):
+    if not re.match(r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$", email):
+        raise HTTPException(status_code=400, detail="Invalid email format.")
+    return email
+
+
+# First error only, as the signup route used to report it
+def legacy_validate(record):
+    try:
+        legacy_name(record["first_name"])
+        legacy_name(record["last_name"])
+        legacy_username(record["username"])
+        legacy_email(record["email"])
+        legacy_mobile(record["mobile"])
+        legacy_password(record["password"])
+    except HTTPException as e:
+        return e.detail
+    return None
+
+
+def make_records(count: int, invalid_percent: int):
+    records = []
+    for i in range(count):
+        record = {"first_name": "Bench", "last_name": "User", "username": f"user_{i:06d}",
+                  "email": f"user{i}@example.com", "mobile": f"{9000000000 + i % 1000000000}",
+                  "password": f"secret{i % 1000}"}
+        if i % 100 < invalid_percent:
+            record.update(last_name="U2", mobile="12345", password="short")
+        records.append(record)
+    return records
+
+
+def best_ns(fn, records, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter_ns()
+        fn(records)
+        best = min(best, time.perf_counter_ns() - started)
+    return best / len(records)
+
+
+STRATEGIES = {
+    "legacy": lambda records: [legacy_validate(record) for record in records],
+    "schema": lambda records: [USER_FORM.validate(record) for record in records],
+    "validate_many": USER_FORM.validate_many,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument("--invalid", type=int, default=30, help="percent of invalid records in the mixed run")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'records':>8} {'invalid %':>10} " + " ".join(f"{name + ' ns':>17}" for name in STRATEGIES))
+    for invalid in (0, args.invalid):
+        records = make_records(args.records, invalid)
+        timings = {name: round(best_ns(fn, records, args.repeat), 1) for name, fn in STRATEGIES.items()}
+        print(f"{args.records:>8} {invalid:>10} " + " ".join(f"{timings[name]:>17}" for name in STRATEGIES))
+        results.append({"records": args.records, "invalid_percent": invalid, "ns_per_record": timings})
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"benchmark": "validation", "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import codecs
+import csv
+import io
+import itertools
+import json
+from datetime import datetime
+from starlette.concurrency import run_in_threadpool
+from async_crud import call_db
+from crud import DuplicateUserError, UNIQUE_FIELDS
+from settings import Settings
+from validation import Schema, USER_FIELDS, REQUIRED
+
+IMPORT_FIELDS = ("first_name", "last_name", "username", "email", "mobile", "password",
+                 "security_question", "security_answer")
+
+# The user form's fields, labelled as on the form; security question and answer only need to be present
+IMPORT_SCHEMA = Schema({
+    **USER_FIELDS,
+    "security_question": ("Security question", REQUIRED),
+    "security_answer": ("Security answer", REQUIRED),
+}, strip=True)
+
+
+# Yield (row number, record dict) from an uploaded CSV or NDJSON file without reading it all into memory.
+# A UTF-8 byte order mark (as written by spreadsheet exports) is skipped
+def read_records(file, fmt: str):
+    text = codecs.getreader("utf-8-sig")(file)
+    if fmt == "csv":
+        for number, record in enumerate(csv.DictReader(text), start=1):
+            yield number, record
+    elif fmt == "ndjson":
+        for number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            yield number, record if isinstance(record, dict) else None
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+
+# Up to size (row number, record) pairs from read_records
+def read_chunk(records, size: int) -> list:
+    return list(itertools.islice(records, size))
+
+
+# Validate one import record; returns (clean record, None) or (None, every error of the record)
+def validate_record(record):
+    return validate_records([record])[0]
+
+# Validate a batch of import records in one pass each; None marks a record that could not be parsed
+def validate_records(records) -> list:
+    results = IMPORT_SCHEMA.validate_many(record for record in records if record is not None)
+    checked = iter(results)
+    validated = []
+    for record in records:
+        if record is None:
+            validated.append((None, "Malformed record"))
+            continue
+        clean, errors = next(checked)
+        validated.append((None, "; ".join(errors.values())) if errors else (clean, None))
+    return validated
+
+
+class BulkImport:
+    """
+    Streams validated records into the users table in batches.
+    Args:
+        db: CRUD or AsyncCRUD instance.
+        hasher: PasswordHasher used to hash each batch in parallel.
+        created_by (str): Username recorded as creator of the imported users.
+        batch_size (int): Rows per INSERT transaction.
+    """
+
+    def __init__(self, db, hasher, created_by: str, batch_size: int = Settings.BULK_BATCH_SIZE):
+        self.db = db
+        self.hasher = hasher
+        self.created_by = created_by
+        self.batch_size = max(1, batch_size)
+        self.inserted = 0
+        self.errors = []
+        self._seen = {field: set() for field in UNIQUE_FIELDS}
+
+    # Reading the upload blocks, so each chunk is read in the threadpool. A file that stops being valid UTF-8
+    # (or CSV) ends the import with an error for the first row not imported
+    async def run(self, records):
+        next_row = 1
+        while True:
+            try:
+                chunk = await run_in_threadpool(read_chunk, records, self.batch_size)
+            except (UnicodeDecodeError, csv.Error) as e:
+                reason = "the file is not UTF-8 encoded" if isinstance(e, UnicodeDecodeError) else f"malformed CSV ({e})"
+                self.errors.append({"row": next_row, "error": f"Import stopped: {reason}; this row and the rest "
+                                                              f"of the file were not imported"})
+                break
+            if not chunk:
+                break
+            next_row = chunk[-1][0] + 1
+            await self._import(chunk)
+        return self.report()
+
+    # Validate a chunk of parsed records as one batch, then insert the valid ones
+    async def _import(self, chunk):
+        batch = []
+        for (number, _), (clean, error) in zip(chunk, validate_records([record for _, record in chunk])):
+            if error is None:
+                error = self._duplicate_in_file(clean)
+            if error:
+                self.errors.append({"row": number, "error": error})
+            else:
+                batch.append((number, clean))
+        if batch:
+            await self._flush(batch)
+
+    def report(self) -> dict:
+        errors = sorted(self.errors, key=lambda error: error["row"])
+        return {"inserted": self.inserted, "failed": len(errors), "errors": errors}
+
+    def _duplicate_in_file(self, clean):
+        for field in UNIQUE_FIELDS:
+            if clean[field] in self._seen[field]:
+                return f"{DuplicateUserError.MESSAGES[field]} earlier in the file"
+        for field in UNIQUE_FIELDS:
+            self._seen[field].add(clean[field])
+        return None
+
+    async def _flush(self, batch):
+        # Drop rows that collide with users already in the database (one query per batch, on the
+        # primary so the rows this import has just written are seen)
+        existing = await call_db(self.db.existing_unique_values,
+                                 *([clean[field] for _, clean in batch] for field in UNIQUE_FIELDS), consistent=True)
+        pending = []
+        for number, clean in batch:
+            taken = next((field for field in UNIQUE_FIELDS if clean[field] in existing[field]), None)
+            if taken:
+                self.errors.append({"row": number, "error": DuplicateUserError.MESSAGES[taken]})
+            else:
+                pending.append((number, clean))
+        if not pending:
+            return
+
+        hashes = await self.hasher.hash_many([clean["password"] for _, clean in pending])
+        now = datetime.now()
+        rows = [dict(clean, password=hashed, created_at=now, updated_at=now,
+                     created_by=self.created_by, updated_by=self.created_by)
+                for (_, clean), hashed in zip(pending, hashes)]
+        try:
+            self.inserted += await call_db(self.db.bulk_add, rows)
+        except DuplicateUserError:
+            # A concurrent writer took one of the values; retry row by row to find it
+            for (number, _), row in zip(pending, rows):
+                try:
+                    await call_db(self.db.add, **row)
+                    self.inserted += 1
+                except DuplicateUserError as e:
+                    self.errors.append({"row": number, "error": str(e)})
+
+
+EXPORT_MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def _format_row(row, fmt: str, columns) -> str:
+    if fmt == "csv":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow([row[key] for key in columns])
+        return buffer.getvalue()
+    return json.dumps({key: row[key] for key in columns}, default=str) + "\n"
+
+
+def _header(fmt: str, columns) -> str:
+    if fmt == "csv":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(columns)
+        return buffer.getvalue()
+    return ""
+
+
+# Export body for StreamingResponse: a plain generator for CRUD, an async generator for AsyncCRUD.
+# Rows are sent in chunks of batch_size lines.
+def export_stream(db, fmt: str, batch_size: int = Settings.EXPORT_BATCH_SIZE):
+    columns = [column.key for column in db.export_columns()]
+    rows = db.iter_export(batch_size)
+    if hasattr(rows, "__aiter__"):
+        async def generate_async():
+            chunk = [_header(fmt, columns)]
+            async for row in rows:
+                chunk.append(_format_row(row._mapping, fmt, columns))
+                if len(chunk) >= batch_size:
+                    yield "".join(chunk)
+                    chunk = []
+            yield "".join(chunk)
+        return generate_async()
+
+    def generate():
+        chunk = [_header(fmt, columns)]
+        for row in rows:
+            chunk.append(_format_row(row._mapping, fmt, columns))
+            if len(chunk) >= batch_size:
+                yield "".join(chunk)
+                chunk = []
+        yield "".join(chunk)
+    return generate()
@@ -0,0 +1,175 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+from async_crud import call_db
+from settings import Settings
+
+CHANGE_FEED_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+# Most skipped ids a reader waits for at once; beyond that the oldest are given up
+MAX_PENDING_GAPS = 1000
+
+
+def change_record(row, cursor: int) -> dict:
+    return {"id": row.id, "cursor": cursor, "user_id": row.user_id, "operation": row.operation,
+            "fields": row.fields.split(",") if row.fields else [],
+            "changed_at": row.changed_at.isoformat(), "changed_by": row.changed_by}
+
+
+# One change as an NDJSON line or an SSE event. The SSE id is the resume cursor, which a reconnecting
+# client sends back in Last-Event-ID
+def format_change(row, cursor: int, fmt: str) -> str:
+    data = json.dumps(change_record(row, cursor))
+    if fmt == "sse":
+        return f"id: {cursor}\nevent: {row.operation}\ndata: {data}\n\n"
+    return data + "\n"
+
+
+class ChangeCursor:
+    """
+    A reader's position in a table read in id order (user_changes, token_revocations). Ids are handed out when a
+    row is inserted but become visible when its transaction commits, so a lower id can appear after a higher one
+    has been read. The ids skipped between two rows read are remembered and read again until they appear or
+    `gap_timeout` seconds pass (a rolled-back write leaves a gap that never fills). resume_id() stays below the
+    oldest id still awaited, so a reader resuming from it may see a row twice but never misses one.
+    Args:
+        after_id (int): Id of the last change already seen.
+        gap_timeout (float): Seconds to wait for a skipped id.
+    """
+
+    def __init__(self, after_id: int, gap_timeout: float = Settings.CHANGE_FEED_GAP_SECONDS):
+        self.last_id = after_id
+        self.gap_timeout = gap_timeout
+        self.gaps = {}  # skipped id -> monotonic time it was noticed
+
+    def resume_id(self) -> int:
+        return min(self.gaps) - 1 if self.gaps else self.last_id
+
+    # The rows not seen before among those read, noting the ids they skip over
+    def advance(self, rows) -> list:
+        now = time.monotonic()
+        new = []
+        for row in rows:
+            if self.gaps.pop(row.id, None) is not None:
+                new.append(row)
+            elif row.id > self.last_id:
+                for missing in range(max(self.last_id + 1, row.id - MAX_PENDING_GAPS), row.id):
+                    self.gaps[missing] = now
+                self.last_id = row.id
+                new.append(row)
+        self.gaps = {gap: noticed for gap, noticed in self.gaps.items() if now - noticed < self.gap_timeout}
+        if len(self.gaps) > MAX_PENDING_GAPS:
+            self.gaps = dict(sorted(self.gaps.items())[-MAX_PENDING_GAPS:])
+        return new
+
+
+class ChangeFeed:
+    """
+    Reader of the user_changes table, the change log every user write appends to in its own transaction.
+    stream() tails it from a cursor for GET /users/changes, and the background sync drops the users other
+    workers changed from this worker's user cache, so cached logins are invalidated precisely instead of
+    waiting for the TTL. The sync also prunes rows older than the retention period.
+    Args:
+        db: CRUD or AsyncCRUD.
+        poll_interval (float): Seconds between reads once the reader has caught up.
+        batch_size (int): Rows read per query.
+        keepalive (float): Idle seconds after which an SSE stream sends a comment line.
+        retention_days (float): Age after which change-log rows are pruned.
+        prune_interval (float): Seconds between two prunes.
+        prune_batch (int): Rows deleted per pruning statement.
+    """
+
+    def __init__(self, db, poll_interval: float = Settings.CHANGE_FEED_POLL_SECONDS,
+                 batch_size: int = Settings.CHANGE_FEED_BATCH, keepalive: float = Settings.CHANGE_FEED_KEEPALIVE_SECONDS,
+                 retention_days: float = Settings.CHANGE_LOG_RETENTION_DAYS,
+                 prune_interval: float = Settings.CHANGE_LOG_PRUNE_SECONDS,
+                 prune_batch: int = Settings.CHANGE_LOG_PRUNE_BATCH):
+        self.db = db
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.keepalive = keepalive
+        self.retention_days = retention_days
+        self.prune_interval = prune_interval
+        self.prune_batch = prune_batch
+        self._cursor = ChangeCursor(0)
+        self._last_prune = 0.0
+        self._task = None
+        self.counts = {"syncs": 0, "invalidated": 0, "failures": 0, "streams": 0, "pruned": 0}
+
+    # (new rows, whether more may be waiting) for the cursor, which is advanced past them
+    async def read(self, cursor: ChangeCursor):
+        rows = await call_db(self.db.changes_since, cursor.last_id, self.batch_size, sorted(cursor.gaps))
+        return cursor.advance(rows), len(rows) == self.batch_size
+
+    # Body for StreamingResponse: the changes after after_id as NDJSON lines or SSE events, one chunk per
+    # batch. A change whose transaction commits late is sent when it appears, after higher ids. Without follow
+    # the stream ends once it has caught up; with follow it keeps polling until the client leaves
+    async def stream(self, after_id: int, fmt: str, follow: bool = False):
+        self.counts["streams"] += 1
+        cursor = ChangeCursor(after_id)
+        last_sent = time.monotonic()
+        while True:
+            rows, more = await self.read(cursor)
+            if rows:
+                last_sent = time.monotonic()
+                # A row's cursor must not pass the rows after it in the batch, which the client has not received yet
+                resume_id = cursor.resume_id()
+                yield "".join(format_change(row, min(row.id, resume_id), fmt) for row in rows)
+                if more:
+                    continue
+            if not follow:
+                return
+            if fmt == "sse" and time.monotonic() - last_sent >= self.keepalive:
+                last_sent = time.monotonic()
+                yield ": keepalive\n\n"
+            await asyncio.sleep(self.poll_interval)
+
+    # Invalidate the cached users changed since the last sync
+    async def sync(self):
+        while True:
+            rows, more = await self.read(self._cursor)
+            for row in rows:
+                self.db.user_cache.invalidate(row.user_id)
+            self.counts["invalidated"] += len(rows)
+            if not more:
+                break
+        self.counts["syncs"] += 1
+
+    # Delete change-log rows older than the retention period, batch by batch
+    async def prune(self) -> int:
+        cutoff = datetime.now() - timedelta(days=self.retention_days)
+        total = 0
+        while True:
+            removed = await call_db(self.db.purge_changes, cutoff, self.prune_batch)
+            total += removed
+            if removed < self.prune_batch:
+                break
+        self.counts["pruned"] += total
+        return total
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.sync()
+                if time.monotonic() - self._last_prune >= self.prune_interval:
+                    self._last_prune = time.monotonic()
+                    await self.prune()
+            except Exception as e:
+                self.counts["failures"] += 1
+                logging.error(f"Change feed sync failed: {e}")
+
+    # The cache starts empty, so earlier changes need no invalidation
+    async def start(self):
+        self._cursor = ChangeCursor(await call_db(self.db.last_change_id))
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"last_id": self._cursor.last_id, "pending_gaps": len(self._cursor.gaps), **self.counts}
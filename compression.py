@@ -0,0 +1,154 @@
+import zlib
+from starlette.datastructures import Headers, MutableHeaders
+from settings import Settings
+
+try:
+    import brotli
+except ImportError:  # optional, only needed for Brotli responses
+    brotli = None
+
+# Content types worth compressing; images, archives and already-encoded bodies are sent as they are.
+# SSE is left out on purpose: proxies and browsers expect each event to arrive as soon as it is sent
+COMPRESSIBLE_TYPES = ("text/html", "text/css", "text/plain", "text/csv", "text/javascript", "application/javascript",
+                      "application/json", "application/x-ndjson", "image/svg+xml")
+
+
+class GzipEncoder:
+    name = "gzip"
+
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    # Compress a streamed chunk and flush it, so the client can decode it without waiting for the next one
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+class BrotliEncoder:
+    name = "br"
+
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.finish()
+
+
+# Codings the client accepts (q > 0) from an Accept-Encoding header
+def accepted_encodings(header: str) -> set:
+    accepted = set()
+    for part in header.split(","):
+        name, _, params = part.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name.strip() and quality > 0:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing responses with Brotli (when the brotli package is installed and the client
+    accepts it) or gzip. Bodies smaller than minimum_size are sent as they are; a streamed body is buffered
+    until it reaches minimum_size, then every chunk is compressed and flushed as it is sent, so streamed pages
+    keep arriving incrementally. A strong ETag is made weak, since the compressed bytes differ from the original.
+    Args:
+        app: The ASGI app to wrap.
+        minimum_size (int): Smallest body, in bytes, worth compressing.
+        gzip_level (int): zlib compression level (1-9).
+        brotli_quality (int): Brotli quality (0-11).
+    """
+
+    def __init__(self, app, minimum_size: int = Settings.COMPRESS_MIN_SIZE, gzip_level: int = Settings.COMPRESS_GZIP_LEVEL,
+                 brotli_quality: int = Settings.COMPRESS_BROTLI_QUALITY):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def _encoder(self, accept_encoding: str):
+        accepted = accepted_encodings(accept_encoding)
+        if brotli is not None and "br" in accepted:
+            return BrotliEncoder(self.brotli_quality)
+        if "gzip" in accepted:
+            return GzipEncoder(self.gzip_level)
+        return None
+
+    @staticmethod
+    def _compressible(start) -> bool:
+        if start["status"] < 200 or start["status"] in (204, 304):
+            return False
+        headers = Headers(raw=start["headers"])
+        if "content-encoding" in headers:
+            return False
+        content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+        return content_type in COMPRESSIBLE_TYPES
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoder = self._encoder(Headers(scope=scope).get("accept-encoding", ""))
+        if encoder is None:
+            await self.app(scope, receive, send)
+            return
+        start = None
+        buffered = []
+        size = 0
+        state = "pending"  # then "compress" or "passthrough"
+
+        async def send_compressed(message):
+            nonlocal start, size, state
+            if message["type"] == "http.response.start":
+                start = message
+                if not self._compressible(start):
+                    state = "passthrough"
+                    await send(start)
+                return
+            if message["type"] != "http.response.body" or state == "passthrough":
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if state == "compress":
+                body = encoder.compress(body) if more_body else encoder.finish(body)
+                await send({"type": "http.response.body", "body": body, "more_body": more_body})
+                return
+            buffered.append(body)
+            size += len(body)
+            if more_body and size < self.minimum_size:
+                return
+            body = b"".join(buffered)
+            buffered.clear()
+            if size < self.minimum_size:
+                state = "passthrough"
+                await send(start)
+                await send({"type": "http.response.body", "body": body, "more_body": False})
+                return
+            state = "compress"
+            body = encoder.compress(body) if more_body else encoder.finish(body)
+            headers = MutableHeaders(scope=start)
+            headers["Content-Encoding"] = encoder.name
+            headers.add_vary_header("Accept-Encoding")
+            if more_body:
+                del headers["Content-Length"]
+            else:
+                headers["Content-Length"] = str(len(body))
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                headers["ETag"] = "W/" + etag
+            await send(start)
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
@@ -1,112 +1,552 @@
-from database import User, Session
+import base64
+import copy
+import json
+import re
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import select, insert, update, delete, or_, and_, func, literal, DateTime, String
+from sqlalchemy.exc import IntegrityError
+from database import User, UserChange, TokenRevocation, PasswordOTP, Session, read_replicas, begin_write
+from replicas import REPLICA_ERRORS
+from settings import Settings
+from user_cache import user_cache
+
+UNIQUE_FIELDS = ("username", "email", "mobile")
+
+# Users that have not been soft-deleted; every read filters on it. The uniqueness checks do not: a deleted
+# user keeps its username, email and mobile in the unique indexes until the purger removes the row
+LIVE = User.deleted_at.is_(None)
+
+# The user, or None when it is missing or soft-deleted (session.get cannot filter)
+def live(user):
+    return user if user is not None and user.deleted_at is None else None
+
+# One statement removing users: "soft" stamps deleted_at, "hard" deletes the rows
+def delete_users_query(user_ids, now, mode):
+    if mode == "hard":
+        return delete(User).where(User.id.in_(user_ids))
+    return update(User).where(User.id.in_(user_ids), LIVE).values(deleted_at=now)
+
+# Change-log rows for user_changes, inserted in the transaction of the change they record.
+# fields names the columns an update wrote, never their values
+def change_rows(user_ids, operation, fields=(), changed_by=None):
+    now = datetime.now()
+    return [{"user_id": user_id, "operation": operation, "fields": ",".join(fields) or None,
+             "changed_at": now, "changed_by": changed_by} for user_id in user_ids]
+
+# INSERT ... SELECT logging one change for every user matching the conditions. changed_by is a
+# username or a column of users (bulk_add logs each row's created_by)
+def log_changes_query(operation, conditions, changed_by=None):
+    if changed_by is None or isinstance(changed_by, str):
+        changed_by = literal(changed_by, String())
+    return insert(UserChange).from_select(
+        ["user_id", "operation", "changed_at", "changed_by"],
+        select(User.id, literal(operation, String()), literal(datetime.now(), DateTime()), changed_by).where(*conditions))
+
+# Version of the users table for conditional GETs: the newest change-log id, plus how many of the ids just before
+# it are committed. Every user write logs a change in its transaction; the count catches a slower transaction
+# committing a lower id after a newer one, which leaves the newest id as it was
+def users_version_query(window: int = 1000):
+    newest = select(func.max(UserChange.id)).scalar_subquery()
+    return select(func.max(UserChange.id), func.count()).where(UserChange.id > newest - window)
+
+def format_version(row) -> str:
+    return f"{row[0] or 0}.{row[1]}"
+
+# Changes after the cursor, plus the lower ids the reader is still waiting for (see change_feed.ChangeCursor),
+# oldest first
+def changes_query(after_id, limit, missing_ids=()):
+    condition = UserChange.id > after_id
+    if missing_ids:
+        condition = or_(condition, UserChange.id.in_(missing_ids))
+    return (select(UserChange.id, UserChange.user_id, UserChange.operation, UserChange.fields,
+                   UserChange.changed_at, UserChange.changed_by)
+            .where(condition).order_by(UserChange.id).limit(limit))
+
+# Unexpired revocations after the cursor, plus the lower ids the reader is still waiting for, oldest first
+def revocations_query(after_id, now, missing_ids=()):
+    condition = TokenRevocation.id > after_id
+    if missing_ids:
+        condition = or_(condition, TokenRevocation.id.in_(missing_ids))
+    return (select(TokenRevocation.id, TokenRevocation.jti, TokenRevocation.user_id,
+                   TokenRevocation.revoked_before, TokenRevocation.expires_at)
+            .where(condition, TokenRevocation.expires_at > now).order_by(TokenRevocation.id))
+
+class DuplicateUserError(Exception):
+    """Raised when a write would duplicate a unique field (username, email or mobile)."""
+    MESSAGES = {
+        "username": "Username already exists",
+        "email": "Email already exists",
+        "mobile": "Mobile number already exists",
+    }
+
+    def __init__(self, field: str = None):
+        self.field = field
+        super().__init__(self.MESSAGES.get(field, "User already exists"))
+
+# Name of the unique column an IntegrityError was raised for (MySQL and SQLite messages), if recognisable
+def violated_field(error: IntegrityError):
+    match = re.search(r"(?:for key '(?:\w+\.)?|UNIQUE constraint failed: \w+\.)(\w+)", str(error.orig))
+    if match and match.group(1) in UNIQUE_FIELDS:
+        return match.group(1)
+    return None
+
+# Single query returning the rows that hold any of the given unique values
+def conflict_query(username, email, mobile, exclude_id=None):
+    query = select(User.username, User.email, User.mobile).where(
+        or_(User.username == username, User.email == email, User.mobile == mobile))
+    if exclude_id is not None:
+        query = query.where(User.id != exclude_id)
+    return query.limit(len(UNIQUE_FIELDS))
+
+# First conflicting field among the rows returned by conflict_query
+def pick_conflict(rows, username, email, mobile):
+    wanted = {"username": username, "email": email, "mobile": mobile}
+    for field in UNIQUE_FIELDS:
+        if any(getattr(row, field) == wanted[field] for row in rows):
+            return field
+    return None
+
+# Columns the user list can be sorted by
+SORT_COLUMNS = {
+    "id": User.id,
+    "first_name": User.first_name,
+    "last_name": User.last_name,
+    "username": User.username,
+    "email": User.email,
+    "created_at": User.created_at,
+    "updated_at": User.updated_at,
+}
+
+# Opaque keyset cursor holding the sort value and id of the last row of a page
+def encode_cursor(sort_value, user_id) -> str:
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([sort_value, user_id]).encode()).decode()
+
+def decode_cursor(cursor: str):
+    sort_value, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return sort_value, int(user_id)
+
+# WHERE conditions for the user list search; every match is a prefix match so the indexes apply
+def search_conditions(name=None, username=None, email=None, mobile=None):
+    conditions = []
+    if name:
+        terms = name.split()
+        if len(terms) >= 2:
+            conditions.append(and_(User.first_name.startswith(terms[0], autoescape=True),
+                                   User.last_name.startswith(" ".join(terms[1:]), autoescape=True)))
+        else:
+            conditions.append(or_(User.first_name.startswith(terms[0], autoescape=True),
+                                  User.last_name.startswith(terms[0], autoescape=True)))
+    if username:
+        conditions.append(User.username.startswith(username, autoescape=True))
+    if email:
+        conditions.append(User.email.startswith(email.lower(), autoescape=True))
+    if mobile:
+        conditions.append(User.mobile.startswith(mobile, autoescape=True))
+    return conditions
+
+# Keyset-paginated list query: seeks past the cursor on (sort column, id) and fetches one extra row
+def list_query(columns, cursor=None, limit=50, filters=None, sort="id", descending=False):
+    sort_column = SORT_COLUMNS.get(sort, User.id)
+    # The cursor needs the sort value, so select the sort column even if it is not displayed
+    if not any(column is sort_column for column in columns):
+        columns = tuple(columns) + (sort_column,)
+    query = select(*columns).where(LIVE, *search_conditions(**(filters or {})))
+    if cursor:
+        sort_value, last_id = decode_cursor(cursor)
+        if isinstance(sort_column.type, DateTime) and sort_value is not None:
+            sort_value = datetime.fromisoformat(sort_value)
+        if sort_column is User.id:
+            query = query.where(User.id < last_id if descending else User.id > last_id)
+        elif descending:
+            query = query.where(or_(sort_column < sort_value, and_(sort_column == sort_value, User.id < last_id)))
+        else:
+            query = query.where(or_(sort_column > sort_value, and_(sort_column == sort_value, User.id > last_id)))
+    if sort_column is User.id:
+        order = [User.id.desc() if descending else User.id]
+    else:
+        order = [sort_column.desc(), User.id.desc()] if descending else [sort_column, User.id]
+    return query.order_by(*order).limit(limit + 1)
+
+# Split the rows of list_query into the page and the cursor of the next page
+def page_with_cursor(rows, limit, sort="id"):
+    if len(rows) <= limit:
+        return rows, None
+    last = rows[limit - 1]
+    sort_key = sort if sort in SORT_COLUMNS else "id"
+    return rows[:limit], encode_cursor(last._mapping[sort_key], last.id)
+
+# Single query returning the rows that already hold any of the given usernames, emails or mobiles
+def existing_values_query(usernames, emails, mobiles):
+    return select(User.username, User.email, User.mobile).where(
+        or_(User.username.in_(usernames), User.email.in_(emails), User.mobile.in_(mobiles)))
+
+# {"username": {...}, "email": {...}, "mobile": {...}} from the rows of existing_values_query
+def collect_unique_values(rows):
+    return {field: {getattr(row, field) for row in rows} for field in UNIQUE_FIELDS}
+
+# Why a verify-and-consume failed, given the OTP row as it is after counting the attempt
+def otp_failure(row, otp, now, max_attempts) -> str:
+    if row is None:
+        return "invalid"
+    if row.otp == otp and row.expires_at <= now:
+        return "expired"
+    if row.attempts >= max_attempts:
+        return "locked"
+    return "invalid"
+
+def consume_otp_query(user_id, otp, now, max_attempts):
+    return delete(PasswordOTP).where(PasswordOTP.user_id == user_id, PasswordOTP.otp == otp,
+                                     PasswordOTP.expires_at > now, PasswordOTP.attempts < max_attempts)
+
+# A unit of work's session remembers which user id each username, email or mobile it looked up belongs
+# to, so asking again is answered from the identity map instead of another query
+def remembered_user_id(session, column, value):
+    return session.info.get("user_keys", {}).get((column.key, value))
+
+def remember_user(session, column, value, user):
+    session.info.setdefault("user_keys", {})[(column.key, value)] = user.id
+
+def forget_users(session):
+    session.info.pop("user_keys", None)
+
+# Users to drop from the user cache once the unit of work commits. Dropping them at the end of the savepoint
+# would let a concurrent request read the old, still committed row and cache it again for the whole TTL
+def invalidate_after_commit(session, user_ids):
+    session.info.setdefault("invalidated_users", set()).update(user_ids)
+
+def pending_invalidations(session):
+    return session.info.pop("invalidated_users", set())
+
+# Column values for an update; optional fields are only written when provided
+def update_values(first_name, last_name, username, email, mobile, password=None, security_question=None,
+                  security_answer=None, updated_at=None, updated_by=None):
+    values = {"first_name": first_name, "last_name": last_name, "username": username, "email": email, "mobile": mobile}
+    optional = {"password": password, "security_question": security_question, "security_answer": security_answer,
+                "updated_at": updated_at, "updated_by": updated_by}
+    values.update({key: value for key, value in optional.items() if value})
+    return values
 
 class CRUD:
     User = User  #Reference to the User model
 
-    def __init__(self):
-        self.Session = Session
+    def __init__(self, session_factory=None, session=None):
+        self.Session = session_factory or Session
+        # Session of the unit of work this CRUD is bound to (see bind); None opens a session per call
+        self.session = session
+        self.replicas = read_replicas
+        self.user_cache = user_cache
+
+    # Copy of this CRUD running every call on the given session (unit_of_work.UnitOfWork)
+    def bind(self, session):
+        bound = copy.copy(self)
+        bound.session = session
+        return bound
+
+    # The bound session, or a new one closed at the end of the block
+    @contextmanager
+    def _session(self):
+        if self.session is not None:
+            yield self.session
+        else:
+            with self.Session() as session:
+                yield session
+
+    # Transaction for a write. Unbound it is committed at the end of the block; bound it is a savepoint
+    # of the request transaction, so a failed write is undone without losing the rest of the request
+    @contextmanager
+    def _transaction(self):
+        if self.session is None:
+            with self.Session() as session, session.begin():
+                yield session
+            return
+        begin_write(self.session)
+        try:
+            with self.session.begin_nested():
+                yield self.session
+        finally:
+            forget_users(self.session)
+
+    # Drop changed users from the user cache, after the commit when bound to a unit of work
+    def _invalidate(self, user_ids):
+        if self.session is not None:
+            invalidate_after_commit(self.session, user_ids)
+            return
+        for user_id in user_ids:
+            self.user_cache.invalidate(user_id)
+
+    # Run query(session) on a read replica. consistent=True (read-your-writes) reads from the primary,
+    # as does any read while no replica is healthy or after the chosen replica fails
+    def _read(self, query, consistent: bool = False):
+        replica = None if consistent else self.replicas.pick()
+        if replica is not None:
+            started = time.perf_counter()
+            try:
+                with replica.Session() as session:
+                    result = query(session)
+            except REPLICA_ERRORS as error:
+                self.replicas.mark_down(replica, error)
+            else:
+                self.replicas.observe(replica, time.perf_counter() - started)
+                return result
+        with self._session() as session:
+            return query(session)
+
+    # User whose unique column equals value; a bound CRUD answers repeated lookups from its identity map
+    def _first(self, column, value, consistent: bool = False):
+        if self.session is not None:
+            user_id = remembered_user_id(self.session, column, value)
+            if user_id is not None:
+                return live(self.session.get(self.User, user_id))
+        user = self._read(lambda session: session.scalar(select(self.User).where(column == value, LIVE).limit(1)), consistent)
+        if user is not None and self.session is not None and user in self.session:
+            remember_user(self.session, column, value, user)
+        return user
 
     # Add new user
     def add(self, first_name, last_name, username, email, mobile, password, security_question, security_answer,created_at, updated_at, created_by, updated_by):
-        with self.Session() as session:
-            new_user = self.User(
-                first_name=first_name,
-                last_name=last_name,
-                username=username,
-                email=email,
-                mobile=mobile,
-                password=password,
-                security_question=security_question,
-                security_answer=security_answer,
-                created_at=created_at,
-                updated_at=updated_at,
-                created_by=created_by,
-                updated_by=updated_by
-            )
-            session.add(new_user)
-            session.commit()
-
-    # Update user by id
+        try:
+            with self._transaction() as session:
+                user = self.User(
+                    first_name=first_name,
+                    last_name=last_name,
+                    username=username,
+                    email=email,
+                    mobile=mobile,
+                    password=password,
+                    security_question=security_question,
+                    security_answer=security_answer,
+                    created_at=created_at,
+                    updated_at=updated_at,
+                    created_by=created_by,
+                    updated_by=updated_by
+                )
+                session.add(user)
+                session.flush()
+                session.execute(insert(UserChange), change_rows([user.id], "create", changed_by=created_by))
+        except IntegrityError as e:
+            raise DuplicateUserError(self._conflict(e, username, email, mobile))
+
+    # Update user by id in a single UPDATE; returns False when the user does not exist
     def update(self, id, first_name, last_name, username, email, mobile, password=None, security_question=None, security_answer=None,updated_at=None, updated_by=None):
-        with self.Session() as session:
-            user = session.get(self.User, id)
-            if user:
-                user.first_name = first_name
-                user.last_name = last_name
-                user.username = username
-                user.email = email
-                user.mobile = mobile
+        values = update_values(first_name, last_name, username, email, mobile, password, security_question,
+                               security_answer, updated_at, updated_by)
+        try:
+            with self._transaction() as session:
+                result = session.execute(update(self.User).where(self.User.id == id, LIVE).values(**values))
+                if result.rowcount:
+                    session.execute(insert(UserChange), change_rows([id], "update", values, updated_by))
+        except IntegrityError as e:
+            raise DuplicateUserError(self._conflict(e, username, email, mobile, exclude_id=id))
+        self._invalidate([id])
+        return result.rowcount > 0
 
-                # Only update password if provided
-                if password:
-                    user.password = password  
+    # Delete user by id
+    def delete(self, id, deleted_by: str = None):
+        return self.delete_users([id], deleted_by=deleted_by) > 0
 
-                # Only update security question/answer if provided
-                if security_question:
-                    user.security_question = security_question
-                if security_answer:
-                    user.security_answer = security_answer
+    # Delete users in one statement, soft or hard depending on DELETE_MODE; returns how many were deleted
+    def delete_users(self, user_ids, mode: str = Settings.DELETE_MODE, deleted_by: str = None) -> int:
+        with self._transaction() as session:
+            session.execute(log_changes_query("delete", [self.User.id.in_(user_ids), LIVE], deleted_by))
+            result = session.execute(delete_users_query(user_ids, datetime.now(), mode))
+        self._invalidate(user_ids)
+        return result.rowcount
 
-                if updated_at:
-                    user.updated_at = updated_at
-                if updated_by:
-                    user.updated_by = updated_by
+    # Hard-delete up to batch_size users soft-deleted before cutoff; returns how many were removed
+    def purge_deleted(self, cutoff, batch_size: int = 500) -> int:
+        with self._transaction() as session:
+            ids = session.scalars(select(self.User.id).where(self.User.deleted_at <= cutoff)
+                                  .limit(batch_size)).all()
+            if ids:
+                session.execute(delete(self.User).where(self.User.id.in_(ids)))
+                session.execute(delete(PasswordOTP).where(PasswordOTP.user_id.in_(ids)))
+                session.execute(insert(UserChange), change_rows(ids, "purge"))
+        return len(ids)
 
-                session.commit()
+    # Show all users
+    def show_all(self, consistent: bool = False):
+        return self._read(lambda session: session.query(self.User).filter(LIVE).all(), consistent)
 
-    # Delete user by id
-    def delete(self, id):
-        with self.Session() as session:
-            user = session.get(self.User, id)
-            if user:
-                session.delete(user)
-                session.commit()
+    # Version of the users table (see users_version_query)
+    def users_version(self) -> str:
+        return format_version(self._read(lambda session: session.execute(users_version_query()).one()))
 
-    # Show all users
-    def show_all(self):
+    # One page of users for the list view, filtered and sorted in the database (keyset pagination).
+    # Returns (rows, next cursor, users_version). The version is read first on the same database as
+    # the rows, so it never names newer data than the page holds
+    def list_page(self, cursor: str = None, limit: int = 50, filters: dict = None, sort: str = "id", descending: bool = False):
+        query = list_query(self.list_columns(), cursor, limit, filters, sort, descending)
+        def read(session):
+            version = format_version(session.execute(users_version_query()).one())
+            return version, session.execute(query).all()
+        version, rows = self._read(read)
+        return page_with_cursor(rows, limit, sort) + (version,)
+
+    # Columns shown in the users list (no password, OTP or security answer)
+    def list_columns(self):
+        return (self.User.id, self.User.first_name, self.User.last_name,
+                self.User.username, self.User.email, self.User.mobile)
+
+    # Columns written by the export (no password, OTP or security answer)
+    def export_columns(self):
+        return self.list_columns() + (self.User.created_at, self.User.updated_at,
+                                      self.User.created_by, self.User.updated_by)
+
+    # Stream users for export from a server-side cursor, batch_size rows at a time. The stream
+    # outlives the request, so it always runs on a session of its own
+    def iter_export(self, batch_size: int = 1000):
         with self.Session() as session:
-            return session.query(self.User).all()
+            query = select(*self.export_columns()).where(LIVE).order_by(self.User.id)
+            yield from session.execute(query.execution_options(stream_results=True, yield_per=batch_size))
+
+    # Unique values already present for a batch of candidate users (one query)
+    def existing_unique_values(self, usernames, emails, mobiles, consistent: bool = False):
+        query = existing_values_query(usernames, emails, mobiles)
+        rows = self._read(lambda session: session.execute(query).all(), consistent)
+        return collect_unique_values(rows)
+
+    # Insert many users in one transaction (executemany); the whole batch fails on a duplicate
+    def bulk_add(self, rows):
+        try:
+            with self._transaction() as session:
+                session.execute(insert(self.User), rows)
+                usernames = [row["username"] for row in rows]
+                session.execute(log_changes_query("create", [self.User.username.in_(usernames)], self.User.created_by))
+        except IntegrityError:
+            raise DuplicateUserError()
+        return len(rows)
 
     # Find by email
-    def get_user_by_email(self, email: str):
-        with self.Session() as session:
-            return session.query(self.User).filter(self.User.email == email).first()
+    def get_user_by_email(self, email: str, consistent: bool = False):
+        return self._first(self.User.email, email, consistent)
 
     # Find by username (for login)
-    def get_user_by_username(self, username: str):
-        with self.Session() as session:
-            return session.query(self.User).filter(self.User.username == username).first()
+    def get_user_by_username(self, username: str, consistent: bool = False):
+        return self._first(self.User.username, username, consistent)
+
+    # Read-only snapshot of the logged-in user, served from the user cache when possible
+    def get_cached_user(self, username: str):
+        snapshot = self.user_cache.get(username)
+        if snapshot is not None:
+            return snapshot
+        user = self.get_user_by_username(username)
+        if user is None:
+            return None
+        return self.user_cache.put(user)
 
     # Find by mobile
-    def get_user_by_mobile(self, mobile: str):
-        with self.Session() as session:
-            return session.query(self.User).filter(self.User.mobile == mobile).first()
+    def get_user_by_mobile(self, mobile: str, consistent: bool = False):
+        return self._first(self.User.mobile, mobile, consistent)
 
     # Find by id
-    def get_user_by_id(self, user_id: int):
-        with self.Session() as session:
-            return session.get(self.User, user_id)
+    def get_user_by_id(self, user_id: int, consistent: bool = False):
+        return self._read(lambda session: live(session.get(self.User, user_id)), consistent)
 
     def update_password(self, user_id: int, new_password: str):
-        with self.Session() as session:
-            user = session.get(self.User, user_id)
+        with self._transaction() as session:
+            user = live(session.get(self.User, user_id))
             if user:
                 user.password = new_password
-                session.commit()
-                return True
-            return False
+                session.execute(insert(UserChange), change_rows([user_id], "update", ["password"]))
+        if user:
+            self._invalidate([user_id])
+            return True
+        return False
     
     def update_otp(self, user_id: int, otp: str, otp_expiry=None):
-        with self.Session() as session:
-            user = session.get(self.User, user_id)
+        with self._transaction() as session:
+            user = live(session.get(self.User, user_id))
             if user:
                 user.otp = otp
                 user.otp_expiry = otp_expiry
-                session.commit()
-                return True
-            return False
+                session.execute(insert(UserChange), change_rows([user_id], "update", ["otp", "otp_expiry"]))
+        return user is not None
+
+    # Unique field (username, email or mobile) already taken by another user, checked in one query
+    def find_conflict(self, username, email, mobile, exclude_id=None, consistent: bool = False):
+        query = conflict_query(username, email, mobile, exclude_id)
+        rows = self._read(lambda session: session.execute(query).all(), consistent)
+        return pick_conflict(rows, username, email, mobile)
+
+    # Which unique field a failed write collided with
+    def _conflict(self, error, username, email, mobile, exclude_id=None):
+        field = violated_field(error)
+        if field is None:
+            field = self.find_conflict(username, email, mobile, exclude_id, consistent=True)
+        return field
+
+    # Persist a token revocation so other workers pick it up
+    def add_revocation(self, expires_at: float, jti: str = None, user_id: int = None, revoked_before: float = None):
+        with self._transaction() as session:
+            session.add(TokenRevocation(jti=jti, user_id=user_id, revoked_before=revoked_before, expires_at=expires_at))
+
+    # Revoke the tokens of several users in one INSERT
+    def add_user_revocations(self, user_ids, revoked_before: float, expires_at: float):
+        with self._transaction() as session:
+            session.execute(insert(TokenRevocation), [{"user_id": user_id, "revoked_before": revoked_before,
+                                                       "expires_at": expires_at} for user_id in user_ids])
+
+    # Revocations recorded after the given id that have not expired yet
+    def revocations_since(self, last_id: int, now: float, missing_ids=()):
+        with self._session() as session:
+            return session.execute(revocations_query(last_id, now, missing_ids)).all()
+
+    # Change-log rows after the given id or among missing_ids (see changes_query); read from the primary
+    def changes_since(self, after_id: int, limit: int, missing_ids=()):
+        with self._session() as session:
+            return session.execute(changes_query(after_id, limit, missing_ids)).all()
+
+    # Delete up to batch_size change-log rows recorded before cutoff; returns how many were removed
+    def purge_changes(self, cutoff, batch_size: int = 1000) -> int:
+        with self._transaction() as session:
+            ids = session.scalars(select(UserChange.id).where(UserChange.changed_at < cutoff)
+                                  .limit(batch_size)).all()
+            if ids:
+                session.execute(delete(UserChange).where(UserChange.id.in_(ids)))
+        return len(ids)
+
+    # Id of the newest change-log row, 0 when there is none
+    def last_change_id(self) -> int:
+        with self._session() as session:
+            return session.scalar(select(func.max(UserChange.id))) or 0
+
+    # Remove revocations whose tokens have expired anyway
+    def purge_revocations(self, now: float):
+        with self._transaction() as session:
+            session.execute(delete(TokenRevocation).where(TokenRevocation.expires_at <= now))
+
+    # Store a user's OTP, replacing any pending one
+    def issue_otp(self, user_id: int, otp: str, expires_at):
+        with self._transaction() as session:
+            session.merge(PasswordOTP(user_id=user_id, otp=otp, expires_at=expires_at, attempts=0))
+
+    # Verify and consume an OTP in one DELETE; returns "ok", "invalid", "expired" or "locked"
+    def consume_otp(self, user_id: int, otp: str, now, max_attempts: int) -> str:
+        with self._transaction() as session:
+            if session.execute(consume_otp_query(user_id, otp, now, max_attempts)).rowcount == 1:
+                return "ok"
+            session.execute(update(PasswordOTP).where(PasswordOTP.user_id == user_id)
+                            .values(attempts=PasswordOTP.attempts + 1))
+            status = otp_failure(session.get(PasswordOTP, user_id), otp, now, max_attempts)
+            if status != "invalid":
+                session.execute(delete(PasswordOTP).where(PasswordOTP.user_id == user_id))
+            return status
+
+    # Delete up to batch_size expired OTPs; returns how many were removed
+    def purge_otps(self, now, batch_size: int = 1000) -> int:
+        with self._transaction() as session:
+            ids = session.scalars(select(PasswordOTP.user_id).where(PasswordOTP.expires_at <= now)
+                                  .limit(batch_size)).all()
+            if ids:
+                session.execute(delete(PasswordOTP).where(PasswordOTP.user_id.in_(ids)))
+        return len(ids)
 
     def save(self, user):
-        with self.Session() as session:
+        with self._transaction() as session:
             session.merge(user)
-            session.commit()
+            session.execute(insert(UserChange), change_rows([user.id], "update"))
+        self._invalidate([user.id])
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import threading
+from settings import Settings
+from smtp_utils import make_transport
+from instrumentation import timed
+
+
+class EmailQueue:
+    """
+    In-process outbound email queue drained by background workers.
+    Each worker keeps its own open SMTP connection and retries failed sends with exponential backoff.
+    Args:
+        workers (int): Number of sender tasks (and SMTP connections).
+        max_size (int): Messages that may wait in the queue before enqueue() refuses new ones.
+        max_attempts (int): Send attempts per message before it is dropped.
+        backoff (float): Delay in seconds before the first retry; doubled on each further retry.
+        transport_factory: Callable returning a transport with send() and close().
+    """
+
+    def __init__(self, workers: int = Settings.EMAIL_WORKERS, max_size: int = Settings.EMAIL_QUEUE_SIZE,
+                 max_attempts: int = Settings.EMAIL_MAX_ATTEMPTS, backoff: float = Settings.EMAIL_RETRY_BACKOFF,
+                 idle_seconds: float = Settings.SMTP_IDLE_SECONDS, transport_factory=make_transport):
+        self.workers = workers
+        self.max_size = max_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.idle_seconds = idle_seconds
+        self.transport_factory = transport_factory
+        self._queue = None
+        self._tasks = []
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.rejected = 0
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 5.0):
+        if not self._tasks:
+            return
+        # Give queued messages a chance to go out before cancelling the workers
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Email queue stopped with {self._queue.qsize()} unsent messages")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # Queue a message; returns False when the queue is not running or is full
+    def enqueue(self, receiver_email: str, subject: str, body: str) -> bool:
+        if self._queue is None:
+            return False
+        try:
+            self._queue.put_nowait((receiver_email, subject, body))
+        except asyncio.QueueFull:
+            self._count("rejected")
+            return False
+        self._count("queued")
+        return True
+
+    async def _worker(self):
+        transport = self.transport_factory()
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(self._queue.get(), self.idle_seconds)
+                except asyncio.TimeoutError:
+                    # Nothing to send for a while; don't hold the SMTP connection open
+                    await asyncio.to_thread(transport.close)
+                    continue
+                try:
+                    await self._deliver(transport, *message)
+                finally:
+                    self._queue.task_done()
+        finally:
+            transport.close()
+
+    async def _deliver(self, transport, receiver_email: str, subject: str, body: str):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                with timed("smtp"):
+                    await asyncio.to_thread(transport.send, receiver_email, subject, body)
+                self._count("sent")
+                return
+            except Exception as e:
+                await asyncio.to_thread(transport.close)
+                if attempt == self.max_attempts:
+                    self._count("failed")
+                    logging.error(f"Giving up on email to {receiver_email} after {attempt} attempts: {e}")
+                    return
+                self._count("retries")
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+
+    def _count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"workers": self.workers, "queue_depth": self._queue.qsize() if self._queue else 0,
+                    "queued": self.queued, "sent": self.sent, "failed": self.failed,
+                    "retries": self.retries, "rejected": self.rejected}
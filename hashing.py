@@ -0,0 +1,123 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from passlib.context import CryptContext
+from settings import Settings
+from instrumentation import record
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing pool already has as many pending jobs as it accepts."""
+
+
+# Worker functions live at module level so a process pool can pickle them.
+# Each returns (result, seconds spent hashing).
+def _hash(password: str):
+    started = time.perf_counter()
+    hashed = pwd_context.hash(password)
+    return hashed, time.perf_counter() - started
+
+def _verify(plain_password: str, hashed_password: str):
+    started = time.perf_counter()
+    if hashed_password.startswith("$2b$"):
+        ok = pwd_context.verify(plain_password, hashed_password)
+    else:
+        ok = plain_password == hashed_password
+    return ok, time.perf_counter() - started
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt hashing/verification on a worker pool so it never blocks the event loop.
+    Args:
+        workers (int): Number of pool workers.
+        max_pending (int): Jobs (running + queued) accepted before new ones are rejected.
+        executor (str): "thread" or "process".
+    """
+
+    def __init__(self, workers: int = Settings.HASH_WORKERS, max_pending: int = Settings.HASH_MAX_PENDING,
+                 executor: str = Settings.HASH_EXECUTOR):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor_kind = executor
+        self._executor = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.hash_seconds_total = 0.0
+        self.hash_seconds_max = 0.0
+        self.wait_seconds_total = 0.0
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    async def _run(self, fn, *args):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HashingBusy("Password hashing queue is full")
+            self.pending += 1
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            result, hash_seconds = await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            with self._lock:
+                self.pending -= 1
+        elapsed = time.perf_counter() - started
+        record("bcrypt", hash_seconds)
+        with self._lock:
+            self.completed += 1
+            self.hash_seconds_total += hash_seconds
+            self.hash_seconds_max = max(self.hash_seconds_max, hash_seconds)
+            self.wait_seconds_total += max(elapsed - hash_seconds, 0.0)
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(_verify, plain_password, hashed_password)
+
+    # Hash many passwords using at most `concurrency` pool slots; waits for a slot instead of failing when busy
+    async def hash_many(self, passwords, concurrency: int = None):
+        semaphore = asyncio.Semaphore(concurrency or self.workers)
+
+        async def hash_one(password):
+            async with semaphore:
+                while True:
+                    try:
+                        return await self.hash(password)
+                    except HashingBusy:
+                        await asyncio.sleep(0.05)
+
+        return await asyncio.gather(*(hash_one(password) for password in passwords))
+
+    def stats(self) -> dict:
+        with self._lock:
+            completed = self.completed or 1
+            return {
+                "executor": self.executor_kind,
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "queue_depth": self.pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_hash_ms": round(self.hash_seconds_total / completed * 1000, 2),
+                "max_hash_ms": round(self.hash_seconds_max * 1000, 2),
+                "avg_wait_ms": round(self.wait_seconds_total / completed * 1000, 2),
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
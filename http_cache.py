@@ -0,0 +1,65 @@
+import hashlib
+import os
+from urllib.parse import parse_qs
+from fastapi import Response
+from fastapi.staticfiles import StaticFiles
+
+# Fingerprinted assets change URL whenever their content changes, so browsers may keep them for a year
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Pages built per user: the browser keeps them but revalidates with If-None-Match every time
+REVALIDATE = "private, no-cache"
+
+
+class FingerprintedStaticFiles(StaticFiles):
+    """
+    StaticFiles whose assets are linked as /static/<path>?v=<content hash> (see url(), the templates'
+    static_url). A request carrying the current hash is answered with Cache-Control: immutable;
+    any other request revalidates with the ETag/Last-Modified StaticFiles already sends.
+    Args:
+        prefix (str): Path the app mounts these files at.
+        Other arguments as for StaticFiles.
+    """
+
+    def __init__(self, *args, prefix: str = "/static", **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prefix = prefix
+        self._fingerprints = {}  # relative path -> content hash, read once per process
+
+    def fingerprint(self, path: str) -> str:
+        path = os.path.normpath(path)
+        digest = self._fingerprints.get(path)
+        if digest is None:
+            with open(os.path.join(self.directory, path), "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()[:12]
+            self._fingerprints[path] = digest
+        return digest
+
+    # URL of an asset, changing whenever its content does
+    def url(self, path: str) -> str:
+        return f"{self.prefix}/{path}?v={self.fingerprint(path)}"
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        version = parse_qs(scope.get("query_string", b"").decode()).get("v", [None])[0]
+        current = version is not None and version == self.fingerprint(self.get_path(scope))
+        response.headers["Cache-Control"] = IMMUTABLE if current else "no-cache"
+        return response
+
+
+# Weak ETag identifying a page by the values it was built from
+def weak_etag(*parts) -> str:
+    digest = hashlib.sha256("|".join(str(part) for part in parts).encode()).hexdigest()[:24]
+    return f'W/"{digest}"'
+
+
+# Whether the client's If-None-Match already names this ETag (weak comparison)
+def etag_matches(request_headers, etag: str) -> bool:
+    header = request_headers.get("if-none-match")
+    if not header:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": REVALIDATE})
@@ -0,0 +1,200 @@
+import contextvars
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from sqlalchemy import event
+from settings import Settings
+
+logger = logging.getLogger("usermanager.requests")
+
+# Per-request cost categories reported in Server-Timing, logs and /metrics
+TIMING_KINDS = ("db", "bcrypt", "render", "smtp")
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestTimings:
+    """Costs accumulated while one request is handled."""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = dict.fromkeys(TIMING_KINDS, 0.0)
+
+    def add(self, kind: str, seconds: float):
+        self.seconds[kind] += seconds
+
+    def server_timing(self, total: float) -> str:
+        parts = [f'db;dur={self.seconds["db"] * 1000:.2f};desc="{self.queries} queries"']
+        parts += [f"{kind};dur={self.seconds[kind] * 1000:.2f}" for kind in TIMING_KINDS[1:] if self.seconds[kind]]
+        parts.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(parts)
+
+
+current_timings = contextvars.ContextVar("current_timings", default=None)
+
+
+# Add time spent on `kind` to the current request (and to the process totals)
+def record(kind: str, seconds: float):
+    timings = current_timings.get()
+    if timings is not None:
+        timings.add(kind, seconds)
+    else:
+        metrics.observe_background(kind, seconds)
+
+
+@contextmanager
+def timed(kind: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(kind, time.perf_counter() - started)
+
+
+#--- SQL statement hooks ---
+# The start time lives on the statement's execution context, so a statement that fails (and never reaches
+# after_cursor_execute) leaves nothing behind on the pooled connection; handle_error records its time instead
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.query_started = time.perf_counter()
+
+def _finish_statement(context):
+    started = getattr(context, "query_started", None)
+    if started is None:
+        return
+    context.query_started = None
+    timings = current_timings.get()
+    if timings is not None:
+        timings.queries += 1
+    record("db", time.perf_counter() - started)
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _finish_statement(context)
+
+def _handle_error(exception_context):
+    _finish_statement(exception_context.execution_context)
+
+def attach_engine(engine):
+    engine = getattr(engine, "sync_engine", engine)
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+class Metrics:
+    """Process-wide request metrics rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}        # (method, route, status) -> count
+        self.durations = {}       # route -> [bucket counts..., sum, count]
+        self.queries = {}         # route -> SQL statements
+        self.costs = {}           # (route, kind) -> seconds
+        self.background = dict.fromkeys(TIMING_KINDS, 0.0)
+        self.collectors = []      # callables returning {metric name: value}
+
+    def observe(self, method: str, route: str, status: int, total: float, timings: RequestTimings):
+        with self._lock:
+            key = (method, route, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            histogram = self.durations.setdefault(route, [0] * len(DURATION_BUCKETS) + [0.0, 0])
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if total <= bound:
+                    histogram[index] += 1
+            histogram[-2] += total
+            histogram[-1] += 1
+            self.queries[route] = self.queries.get(route, 0) + timings.queries
+            for kind, seconds in timings.seconds.items():
+                self.costs[(route, kind)] = self.costs.get((route, kind), 0.0) + seconds
+
+    # Costs incurred outside any request (e.g. the email workers)
+    def observe_background(self, kind: str, seconds: float):
+        with self._lock:
+            self.background[kind] = self.background.get(kind, 0.0) + seconds
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    # Export the numeric values of a stats() dict as gauges named <prefix>_<key>
+    def add_stats(self, prefix: str, stats):
+        self.add_collector(lambda: {f"{prefix}_{key}": value for key, value in stats().items()
+                                    if isinstance(value, (int, float)) and not isinstance(value, bool)})
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            lines.append("# TYPE http_requests_total counter")
+            for (method, route, status), count in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{{method="{method}",route="{route}",status="{status}"}} {count}')
+            lines.append("# TYPE http_request_duration_seconds histogram")
+            for route, histogram in sorted(self.durations.items()):
+                for bound, count in zip(DURATION_BUCKETS, histogram):
+                    lines.append(f'http_request_duration_seconds_bucket{{route="{route}",le="{bound}"}} {count}')
+                lines.append(f'http_request_duration_seconds_bucket{{route="{route}",le="+Inf"}} {histogram[-1]}')
+                lines.append(f'http_request_duration_seconds_sum{{route="{route}"}} {histogram[-2]:.6f}')
+                lines.append(f'http_request_duration_seconds_count{{route="{route}"}} {histogram[-1]}')
+            lines.append("# TYPE http_request_db_queries_total counter")
+            for route, count in sorted(self.queries.items()):
+                lines.append(f'http_request_db_queries_total{{route="{route}"}} {count}')
+            lines.append("# TYPE http_request_cost_seconds_total counter")
+            for (route, kind), seconds in sorted(self.costs.items()):
+                lines.append(f'http_request_cost_seconds_total{{route="{route}",kind="{kind}"}} {seconds:.6f}')
+            lines.append("# TYPE background_cost_seconds_total counter")
+            for kind, seconds in sorted(self.background.items()):
+                lines.append(f'background_cost_seconds_total{{kind="{kind}"}} {seconds:.6f}')
+        for collector in self.collectors:
+            for name, value in collector().items():
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class InstrumentationMiddleware:
+    """
+    ASGI middleware that attributes query count and DB, bcrypt, render and SMTP time to each request.
+    Sends them as a Server-Timing header, logs one JSON line per request (WARNING when slower
+    than SLOW_REQUEST_MS) and feeds the /metrics counters.
+    """
+
+    def __init__(self, app, slow_request_ms: float = Settings.SLOW_REQUEST_MS):
+        self.app = app
+        self.slow_request_seconds = slow_request_ms / 1000
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                header = timings.server_timing(time.perf_counter() - started)
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"server-timing", header.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            total = time.perf_counter() - started
+            current_timings.reset(token)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            metrics.observe(scope["method"], route, status, total, timings)
+            self._log(scope, route, status, total, timings)
+
+    def _log(self, scope, route, status, total, timings):
+        level = logging.WARNING if total >= self.slow_request_seconds else logging.INFO
+        if not logger.isEnabledFor(level):
+            return
+        entry = {"method": scope["method"], "path": scope["path"], "route": route, "status": status,
+                 "total_ms": round(total * 1000, 2), "queries": timings.queries}
+        entry.update({f"{kind}_ms": round(seconds * 1000, 2) for kind, seconds in timings.seconds.items()})
+        logger.log(level, json.dumps(entry))
@@ -1,4 +1,6 @@
 import jwt
+import time
+import uuid
 from datetime import datetime, timedelta
 from passkey import PassKey
 
@@ -16,6 +18,21 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+# Version of the claim set below; tokens without it only carry "sub"
+CLAIMS_VERSION = 1
+
+# Token carrying what routes need about the user, so requests can be served without a DB read
+def create_user_token(user, expires_delta: timedelta = None):
+    return create_access_token({
+        "sub": user.username,
+        "uid": user.id,
+        "fn": user.first_name,
+        "ln": user.last_name,
+        "ver": CLAIMS_VERSION,
+        "jti": uuid.uuid4().hex,
+        "iat": time.time(),
+    }, expires_delta)
+
 def decode_access_token(token: str):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -1,263 +1,474 @@
-from fastapi import FastAPI, HTTPException, Request, Form, Depends, status, Cookie
-from passlib.context import CryptContext
-from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.staticfiles import StaticFiles
-from crud import CRUD
-from datetime import datetime, timedelta
-from jwt_utils import create_access_token, decode_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Form, Depends, status, Cookie, Header, UploadFile, File
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse, PlainTextResponse
+from contextlib import asynccontextmanager
+from database import init_engines, dispose_engines
+from crud import CRUD, DuplicateUserError, SORT_COLUMNS
+from async_crud import AsyncCRUD, call_db
+from unit_of_work import UnitOfWork
+from settings import Settings
+from datetime import datetime
+from jwt_utils import create_user_token, decode_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, CLAIMS_VERSION
+from revocation import TokenRevocations
+from otp_store import make_otp_store
+from user_purge import UserPurger
+from change_feed import ChangeFeed, CHANGE_FEED_MEDIA_TYPES
+from rate_limit import rate_limiter
+from user_cache import UserSnapshot
 import random
-from typing import Optional
-from smtp_utils import send_email
-from validation import validate_name, validate_password, validate_mobile, validate_username, validate_email
-
-
-app = FastAPI()
-db = CRUD()
-app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+import secrets
+import math
+from typing import List, Optional
+from email_queue import EmailQueue
+from validation import USER_FORM, UPDATE_FORM
+from hashing import PasswordHasher, HashingBusy
+from pool_metrics import pool_metrics
+from instrumentation import InstrumentationMiddleware, metrics
+from rendering import build_environment, warm_templates, stream_template, template_version, TimedTemplates
+from http_cache import FingerprintedStaticFiles, weak_etag, etag_matches, not_modified, REVALIDATE
+from compression import CompressionMiddleware
+from bulk import BulkImport, read_records, export_stream, EXPORT_MEDIA_TYPES
+
+
+router = APIRouter()
+db = AsyncCRUD() if Settings.DB_BACKEND == "async" else CRUD()
+# Built by load_templates() on startup, so importing this module reads no template files
+template_env = None
+templates = None
+templates_version = None
+# Static assets, linked from the templates under fingerprinted URLs (static_url)
+static_files = FingerprintedStaticFiles(directory="static", check_dir=False)
+hasher = PasswordHasher()
+email_queue = EmailQueue()
+revocations = TokenRevocations(db)
+otp_store = make_otp_store(db)
+user_purger = UserPurger(db)
+change_feed = ChangeFeed(db)
+metrics.add_stats("user_cache", db.user_cache.stats)
+metrics.add_stats("password_hasher", hasher.stats)
+metrics.add_stats("db_pool", pool_metrics.stats)
+metrics.add_stats("read_replicas", db.replicas.stats)
+metrics.add_stats("email_queue", email_queue.stats)
+metrics.add_stats("token_revocations", revocations.stats)
+metrics.add_stats("otp_store", otp_store.stats)
+metrics.add_stats("user_purge", user_purger.stats)
+metrics.add_stats("change_feed", change_feed.stats)
+metrics.add_stats("rate_limit", rate_limiter.stats)
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
 
 
 # Jinja templates
-def render_templates(name: str, request: Request, **context):
-    response = templates.TemplateResponse(name, {"request": request, **context})
+def render_templates(name: str, request: Request, status_code: int = 200, **context):
+    response = templates.TemplateResponse(name, {"request": request, **context}, status_code=status_code)
     return response
 
+# Large pages are streamed chunk by chunk instead of rendered into one string
+def stream_templates(name: str, request: Request, status_code: int = 200, **context):
+    return stream_template(template_env, name, {"request": request, **context}, status_code=status_code)
+
+def load_templates():
+    global template_env, templates, templates_version
+    if template_env is None:
+        template_env = build_environment(static_url=static_files.url)
+        templates = TimedTemplates(env=template_env)
+        warm_templates(template_env)
+        templates_version = template_version(template_env)
+
+# ETag of a page listing users: the users table version, the query (search, sort, cursor), the viewer
+# (shown in the page) and the templates
+def users_page_etag(request: Request, version: str, current_user) -> str:
+    return weak_etag(version, request.url.query, templates_version, current_user.id, current_user.username,
+                     current_user.first_name, current_user.last_name)
+
 
 #--- Password Hashing ---
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
-def verify_password(plain_password, hashed_password):
-    if hashed_password.startswith("$2b$"):
-        return pwd_context.verify(plain_password, hashed_password)
-    else:
-        return plain_password == hashed_password
-    
+# Hashing runs on the hashing pool (hashing.PasswordHasher); these raise HashingBusy when it is saturated
+async def hash_password_async(password):
+    return await hasher.hash(password)
+
+async def verify_password_async(plain_password, hashed_password):
+    return await hasher.verify(plain_password, hashed_password)
+
+BUSY_MESSAGE = "Server is busy, please try again in a moment"
+
+#--- Unit of work ---
+# One session per request: the CRUD calls made through uow.db share one connection and one transaction,
+# committed before the response is sent. Routes call uow.release() before hashing a password
+async def get_unit_of_work():
+    async with UnitOfWork(db) as uow:
+        yield uow
+
 #--- Authenticate User ---
-def authenticate_user(username: str, password: str):
-    user = db.get_user_by_username(username) 
+async def authenticate_user(username: str, password: str, uow=None):
+    # Password checks read the primary so a lagging replica never accepts a replaced password
+    user = await call_db((uow.db if uow else db).get_user_by_username, username, consistent=True)
     if not user:
         return False
-    if not verify_password(password, user.password):
+    if uow is not None:
+        await uow.release()
+    if not await verify_password_async(password, user.password):
         return False
     return user
 
 #--- JWT Dependency ---
-def get_current_user(access_token: str = Cookie(None)):
+async def get_current_user(access_token: str = Cookie(None), uow= Depends(get_unit_of_work)):
     if access_token is None:
         return None
     payload = decode_access_token(access_token)
-    if payload is None:
+    if payload is None or revocations.is_revoked(payload):
         return None
+    # Stateless mode: the token claims are enough, no DB read
+    if Settings.AUTH_MODE == "stateless" and payload.get("ver") == CLAIMS_VERSION:
+        return UserSnapshot(id=payload["uid"], first_name=payload.get("fn"), last_name=payload.get("ln"),
+                            username=payload["sub"], email=None, mobile=None)
     username = payload.get("sub")
     if username is None:
         return None
-    user = db.get_user_by_username(username)
+    user = await call_db(uow.db.get_cached_user, username)
     if user is None:
         return None
     return user
 
+#--- Rate limiting ---
+RATE_LIMITED_MESSAGE = "Too many attempts, please try again later"
+
+def client_ip(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
+
+def too_many_requests(name: str, request: Request, retry_after: float, **context):
+    response = render_templates(name, request, status_code=429, error=RATE_LIMITED_MESSAGE, **context)
+    response.headers["Retry-After"] = str(math.ceil(retry_after))
+    return response
+
 #--- for sending otp via email ---
 def generate_otp_email(otp: str, expiry: int = 3) -> str:
-        template = templates.get_template("email_otp.html")
-        return template.render(otp=otp, expiry=expiry)
+        return template_env.get_template("email_otp.html").render(otp=otp, expiry=expiry)
 
 #--- Routes ---
 # to render login page
-@app.get("/", response_class=HTMLResponse)
+@router.get("/", response_class=HTMLResponse)
 def get_login(request: Request,current_user= Depends(get_current_user)):
     if current_user:
         return RedirectResponse(url="/home?msg=You are already logged in", status_code=303)
     return render_templates("login.html", request)
 
 # to render signup page
-@app.get("/signup", response_class=HTMLResponse)
+@router.get("/signup", response_class=HTMLResponse)
 def get_signup(request: Request,current_user= Depends(get_current_user)):
     if current_user:
         return RedirectResponse(url="/home?msg=You are already logged in", status_code=303)
     return render_templates("signup.html", request)
 
 #--- Logout user ---
-@app.get("/logout")
-async def logout():
+@router.get("/logout")
+async def logout(access_token: str = Cookie(None), uow= Depends(get_unit_of_work)):
+    payload = decode_access_token(access_token) if access_token else None
+    if payload:
+        await revocations.revoke_token(payload, db=uow.db)
     response = RedirectResponse(url="/?msg=You have been logged out successfully", status_code=303)
     response.delete_cookie("access_token")
     return response
 
 #--- Login user ---
-@app.post("/login")
-async def login(request: Request, username: str = Form(...), password: str = Form(...)):
-    user = authenticate_user(username, password)
+@router.post("/login")
+async def login(request: Request, username: str = Form(...), password: str = Form(...), uow= Depends(get_unit_of_work)):
+    retry_after = await rate_limiter.check("login", client_ip(request), username)
+    if retry_after:
+        return too_many_requests("login.html", request, retry_after)
+    try:
+        user = await authenticate_user(username, password, uow)
+    except HashingBusy:
+        return templates.TemplateResponse("login.html", {"request": request, "error": BUSY_MESSAGE}, status_code=503)
     if not user:
         return templates.TemplateResponse("login.html",{"request": request, "error": "Invalid username or password!"})
-    access_token = create_access_token(data={"sub": user.username})
+    access_token = create_user_token(user)
     response =  RedirectResponse("/home?msg= User login successful",status_code=303)
     response.set_cookie(key="access_token", value=access_token, httponly=True, max_age=ACCESS_TOKEN_EXPIRE_MINUTES * 60,
                         expires=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
     return response
 
 #--- Signup user ---
-@app.post("/signup")
+@router.post("/signup")
 async def post_signup(request: Request, first_name: str = Form(...), last_name: str = Form(...), username: str = Form(...),
                        email: str = Form(...), mobile: str = Form(...),password: str = Form(...), security_question: str = Form(...), 
-                       security_answer: str = Form(...)):
+                       security_answer: str = Form(...), uow= Depends(get_unit_of_work)):
+    errors = USER_FORM.errors({"first_name": first_name, "last_name": last_name, "username": username,
+                               "email": email, "mobile": mobile, "password": password})
+    if errors:
+        return templates.TemplateResponse("signup.html", {"request": request, "errors": errors})
     try:
-        first_name = validate_name(first_name)
-        last_name = validate_name(last_name)
-        password = validate_password(password)
-        username = validate_username(username)
-        email = validate_email(email)
-        mobile = validate_mobile(mobile)
-    except HTTPException as e:
-        return templates.TemplateResponse("signup.html", {"request": request, "error": e.detail})
-    try:
-        hashed_password = get_password_hash(password)
-        db.add(first_name, last_name, username, email, mobile, hashed_password, security_question, security_answer, datetime.now().isoformat(),datetime.now().isoformat(), username, username)
+        # Cheap uniqueness check before spending a bcrypt hash; the unique keys still guard the insert
+        conflict = await call_db(uow.db.find_conflict, username, email, mobile)
+        if conflict:
+            raise DuplicateUserError(conflict)
+        await uow.release()
+        hashed_password = await hash_password_async(password)
+        await call_db(uow.db.add, first_name, last_name, username, email, mobile, hashed_password, security_question, security_answer, datetime.now(),datetime.now(), username, username)
         return RedirectResponse(url="/?msg=Signup successful. Please Login", status_code=303)
+    except DuplicateUserError as e:
+        return templates.TemplateResponse("signup.html", {"request": request, "error": str(e)})
+    except HashingBusy:
+        return templates.TemplateResponse("signup.html", {"request": request, "error": BUSY_MESSAGE}, status_code=503)
     except Exception as e:
         return templates.TemplateResponse("signup.html", {"request": request, "error": str(e)})
 
 # to render home page with users list
-@app.get("/home", response_class=HTMLResponse)
-async def get_users(request: Request, current_user= Depends(get_current_user)):
+@router.get("/home", response_class=HTMLResponse)
+async def get_users(request: Request, cursor: Optional[str] = None, size: int = DEFAULT_PAGE_SIZE,
+                    name: Optional[str] = None, username: Optional[str] = None, email: Optional[str] = None,
+                    mobile: Optional[str] = None, sort: str = "id", order: str = "asc",
+                    current_user= Depends(get_current_user), uow= Depends(get_unit_of_work)):
     if current_user is None:
         return RedirectResponse(url="/?msg=You need to login first", status_code=303)
     try:
-        users = db.show_all()
-        return render_templates("home.html", request, users=users, current_user=current_user)
+        size = max(1, min(size, MAX_PAGE_SIZE))
+        sort = sort if sort in SORT_COLUMNS else "id"
+        filters = {"name": name, "username": username, "email": email, "mobile": mobile}
+        # Unchanged list: answer the browser's If-None-Match with a 304, without listing or rendering
+        if "if-none-match" in request.headers:
+            etag = users_page_etag(request, await call_db(uow.db.users_version), current_user)
+            if etag_matches(request.headers, etag):
+                return not_modified(etag)
+        users, next_cursor, version = await call_db(uow.db.list_page, cursor=cursor, limit=size, filters=filters,
+                                                    sort=sort, descending=order == "desc")
+        # Pagination links keep the search and sort parameters
+        base_url = request.url.remove_query_params(["cursor", "msg"])
+        first_url = str(base_url) if cursor else None
+        next_url = str(base_url.include_query_params(cursor=next_cursor)) if next_cursor else None
+        response = stream_templates("home.html", request, users=users, current_user=current_user, size=size,
+                                    filters=filters, sort=sort, order=order, sort_options=list(SORT_COLUMNS),
+                                    first_url=first_url, next_url=next_url)
+        response.headers["ETag"] = users_page_etag(request, version, current_user)
+        response.headers["Cache-Control"] = REVALIDATE
+        return response
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error: {str(e)}")
     
+#--- cache statistics ---
+@router.get("/stats/user-cache")
+async def get_user_cache_stats(current_user= Depends(get_current_user)):
+    if current_user is None:
+        return RedirectResponse(url="/?msg=You need to login first", status_code=303)
+    return JSONResponse(db.user_cache.stats())
+
+@router.get("/stats/password-hasher")
+async def get_password_hasher_stats(current_user= Depends(get_current_user)):
+    if current_user is None:
+        return RedirectResponse(url="/?msg=You need to login first", status_code=303)
+    return JSONResponse(hasher.stats())
+
+@router.get("/stats/db-pool")
+async def get_db_pool_stats(current_user= Depends(get_current_user)):
+    if current_user is None:
+        return RedirectResponse(url="/?msg=You need to login first", status_code=303)
+    return JSONResponse(pool_metrics.stats())
+
+@router.get("/stats/read-replicas")
+async def get_read_replica_stats(current_user= Depends(get_current_user)):
+    if current_user is None:
+        return RedirectResponse(url="/?msg=You need to login first", status_code=303)
+    return JSONResponse(db.replicas.stats())
+
+@router.get("/stats/email-queue")
+async def get_email_queue_stats(current_user= Depends(get_current_user)):
+    if current_user is None:
+        return RedirectResponse(url="/?msg=You need to login first", status_code=303)
+    return JSONResponse(email_queue.stats())
+
+# Whether the request carries the scraper token (Authorization: Bearer <METRICS_TOKEN>)
+def has_metrics_token(authorization: Optional[str]) -> bool:
+    if not Settings.METRICS_TOKEN or not authorization:
+        return False
+    scheme, _, token = authorization.partition(" ")
+    return scheme.lower() == "bearer" and secrets.compare_digest(token.strip().encode(), Settings.METRICS_TOKEN.encode())
+
+# Prometheus-style metrics (per-route requests, latency, queries and costs), for logged-in users or the scraper
+# token. Scrapers do not follow the login redirect, so a missing login is answered with 401
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(authorization: Optional[str] = Header(None), current_user= Depends(get_current_user)):
+    if current_user is None and not has_metrics_token(authorization):
+        return PlainTextResponse("Not authenticated", status_code=401, headers={"WWW-Authenticate": "Bearer"})
+    return metrics.render()
+
 #--- delete User ---
-@app.get("/delete/{id}")
-async def delete_user(id: int, current_user=Depends(get_current_user)):
+@router.get("/delete/{id}")
+async def delete_user(id: int, current_user=Depends(get_current_user), uow= Depends(get_unit_of_work)):
     if current_user is None:
         return RedirectResponse(url="/?msg=You need to login first", status_code=303)
     try:
-        db.delete(id)
+        await call_db(uow.db.delete, id, deleted_by=current_user.username)
+        await revocations.revoke_user(id, db=uow.db)
         return RedirectResponse(url="/home?msg=User deleted successfully", status_code=303)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error: {str(e)}")
 
+# Delete the users selected on /home in one statement
+@router.post("/users/delete")
+async def delete_users(ids: List[int] = Form([]), current_user=Depends(get_current_user), uow= Depends(get_unit_of_work)):
+    if current_user is None:
+        return RedirectResponse(url="/?msg=You need to login first", status_code=303)
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return RedirectResponse(url="/home?msg=No users selected", status_code=303)
+    if len(ids) > MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"Select at most {MAX_PAGE_SIZE} users")
+    try:
+        deleted = await call_db(uow.db.delete_users, ids, deleted_by=current_user.username)
+        await revocations.revoke_users(ids, db=uow.db)
+        return RedirectResponse(url=f"/home?msg={deleted} users deleted successfully", status_code=303)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error: {str(e)}")
+
 # --- Show Update Form (prefilled) ---
-@app.get("/update/{id}", response_class=HTMLResponse)
-async def get_update_form(request: Request, id: int, current_user= Depends(get_current_user)):
+@router.get("/update/{id}", response_class=HTMLResponse)
+async def get_update_form(request: Request, id: int, current_user= Depends(get_current_user), uow= Depends(get_unit_of_work)):
     if current_user is None:
         return RedirectResponse(url="/?msg=You need to login first", status_code=303)
-    user = db.get_user_by_id(id)
+    user = await call_db(uow.db.get_user_by_id, id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return render_templates("update.html", request, user=user)
 
 # --- Handle Update Submission ---
-@app.post("/update/{id}")
+@router.post("/update/{id}")
 async def post_update(request: Request,id: int,first_name: str = Form(...),last_name: str = Form(...),username: str = Form(...), 
                       email: str = Form(...), mobile: str = Form(...),password: str = Form(None), security_question: str = Form(None), 
-                      security_answer: str = Form(None), current_user= Depends(get_current_user)):
+                      security_answer: str = Form(None), current_user= Depends(get_current_user),
+                      uow= Depends(get_unit_of_work)):
     
     if current_user is None:
         return RedirectResponse(url="/?msg=You need to login first", status_code=303)
-    try:
-        first_name = validate_name(first_name)
-        last_name = validate_name(last_name)
-        username = validate_username(username)
-        email = validate_email(email)
-        mobile = validate_mobile(mobile)
-        if password:
-            password = validate_password(password)
-    except HTTPException as e:
-        return templates.TemplateResponse("update.html", {"request": request, "error": e.detail})
+    errors = UPDATE_FORM.errors({"first_name": first_name, "last_name": last_name, "username": username,
+                                 "email": email, "mobile": mobile, "password": password})
+    if errors:
+        return templates.TemplateResponse("update.html", {"request": request, "errors": errors})
     
     try:
-        # Fetch existing user
-        existing_user = db.get_user_by_id(id)
-        if not existing_user:
-            raise HTTPException(status_code=404, detail="User not found")
-
-        # Check uniqueness (ignore current user’s own values)
-        if db.get_user_by_username(username) and username != existing_user.username:
-            return render_templates("update.html", request, user=existing_user,
-                                    error=" Username already exists")
-        if db.get_user_by_email(email) and email != existing_user.email:
-            return render_templates("update.html", request, user=existing_user,
-                                    error=" Email already exists")
-        if db.get_user_by_mobile(mobile) and mobile != existing_user.mobile:
-            return render_templates("update.html", request, user=existing_user,
-                                    error=" Mobile number already exists")
-
-        # Hash password if provided
-        hashed_password = get_password_hash(password) if password else None
+        # Only pre-check uniqueness when a password has to be hashed; otherwise the unique keys decide
+        if password:
+            # Read-your-writes: a lagging replica could miss a value taken a moment ago
+            conflict = await call_db(uow.db.find_conflict, username, email, mobile, exclude_id=id, consistent=True)
+            if conflict:
+                raise DuplicateUserError(conflict)
+        hashed_password = None
+        if password:
+            await uow.release()
+            hashed_password = await hash_password_async(password)
 
         # Update user
-        db.update(id, first_name, last_name, username, email, mobile,hashed_password, security_question, security_answer, 
-                  datetime.now().isoformat(), current_user.username)
-        return RedirectResponse(url="/home?msg=User updated succesfully", status_code=303)
-
+        updated = await call_db(uow.db.update, id, first_name, last_name, username, email, mobile,hashed_password, security_question, security_answer, 
+                  datetime.now(), current_user.username)
+    except DuplicateUserError as e:
+        existing_user = await call_db(uow.db.get_user_by_id, id, consistent=True)
+        return render_templates("update.html", request, user=existing_user, error=f" {e}")
+    except HashingBusy:
+        existing_user = await call_db(uow.db.get_user_by_id, id, consistent=True)
+        return render_templates("update.html", request, status_code=503, user=existing_user, error=BUSY_MESSAGE)
     except Exception as e:
+        existing_user = await call_db(uow.db.get_user_by_id, id, consistent=True)
         return render_templates("update.html", request, user=existing_user, error=f"Error: {str(e)}")
 
+    if not updated:
+        raise HTTPException(status_code=404, detail="User not found")
+    return RedirectResponse(url="/home?msg=User updated succesfully", status_code=303)
 
 # --- Add User ---
-@app.get("/add", response_class=HTMLResponse)
+@router.get("/add", response_class=HTMLResponse)
 async def get_add_form(request: Request):
     return render_templates("add.html", request)
 
-@app.post("/add")
+@router.post("/add")
 async def add_user(request: Request, first_name: str = Form(...), last_name: str = Form(...), username: str = Form(...),
                    email: str = Form(...), mobile: str = Form(...), password: str = Form(...),security_question: str = Form(...), 
-                   security_answer: str = Form(...), current_user= Depends(get_current_user)):
+                   security_answer: str = Form(...), current_user= Depends(get_current_user),
+                   uow= Depends(get_unit_of_work)):
     if current_user is None:
         return RedirectResponse(url="/?msg=You need to login first", status_code=303)
-    try:
-        first_name = validate_name(first_name)
-        last_name = validate_name(last_name)
-        password = validate_password(password)
-        username = validate_username(username)
-        email = validate_email(email)
-        mobile = validate_mobile(mobile)
-    except HTTPException as e:
-        return templates.TemplateResponse("signup.html", {"request": request, "error": e.detail})
+    errors = USER_FORM.errors({"first_name": first_name, "last_name": last_name, "username": username,
+                               "email": email, "mobile": mobile, "password": password})
+    if errors:
+        return render_templates("add.html", request, errors=errors)
     
     try:
-        # Check uniqueness
-        if db.get_user_by_username(username):
-            return render_templates("add.html", request, error="Username already exists")
-        if db.get_user_by_email(email):
-            return render_templates("add.html", request, error="Email already exists")
-        if db.get_user_by_mobile(mobile):
-            return render_templates("add.html", request, error="Mobile number already exists")
+        # Check uniqueness in one query before hashing; the unique keys still guard the insert
+        conflict = await call_db(uow.db.find_conflict, username, email, mobile)
+        if conflict:
+            raise DuplicateUserError(conflict)
 
         # Hash password and add user
-        hashed_password = get_password_hash(password)
-        db.add(first_name, last_name, username, email, mobile,hashed_password, security_question, security_answer, 
-               datetime.now().isoformat(),datetime.now().isoformat(), current_user.username, current_user.username)
+        await uow.release()
+        hashed_password = await hash_password_async(password)
+        await call_db(uow.db.add, first_name, last_name, username, email, mobile,hashed_password, security_question, security_answer, 
+               datetime.now(),datetime.now(), current_user.username, current_user.username)
         return RedirectResponse(url="/home?msg=User added successfully", status_code=303)
 
+    except DuplicateUserError as e:
+        return render_templates("add.html", request, error=str(e))
+    except HashingBusy:
+        return render_templates("add.html", request, status_code=503, error=BUSY_MESSAGE)
     except Exception as e:
         return render_templates("add.html", request, error=f"Error: {str(e)}")
     
+#--- Bulk import / export ---
+@router.post("/users/import")
+async def import_users(file: UploadFile = File(...), format: Optional[str] = Form(None),
+                       current_user= Depends(get_current_user)):
+    if current_user is None:
+        return RedirectResponse(url="/?msg=You need to login first", status_code=303)
+    fmt = format or ("ndjson" if (file.filename or "").endswith((".ndjson", ".jsonl")) else "csv")
+    if fmt not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Format must be csv or ndjson")
+    report = await BulkImport(db, hasher, current_user.username).run(read_records(file.file, fmt))
+    return JSONResponse(report)
+
+@router.get("/users/export")
+async def export_users(format: str = "csv", current_user= Depends(get_current_user)):
+    if current_user is None:
+        return RedirectResponse(url="/?msg=You need to login first", status_code=303)
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Format must be csv or ndjson")
+    return StreamingResponse(export_stream(db, format), media_type=EXPORT_MEDIA_TYPES[format],
+                             headers={"Content-Disposition": f"attachment; filename=users.{format}"})
+
+#--- Change feed ---
+# Tail the user change log after a cursor (?after=<id>, or the Last-Event-ID header an SSE client sends when
+# it reconnects). Without follow the stream ends once it has caught up
+@router.get("/users/changes")
+async def get_user_changes(after: int = 0, format: str = "ndjson", follow: bool = False,
+                           last_event_id: Optional[int] = Header(None), current_user= Depends(get_current_user)):
+    if current_user is None:
+        return RedirectResponse(url="/?msg=You need to login first", status_code=303)
+    if format not in CHANGE_FEED_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Format must be ndjson or sse")
+    cursor = last_event_id if last_event_id is not None else after
+    return StreamingResponse(change_feed.stream(cursor, format, follow), media_type=CHANGE_FEED_MEDIA_TYPES[format],
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 #--- forgot password ---
-@app.get("/forgot-password", response_class=HTMLResponse)
+@router.get("/forgot-password", response_class=HTMLResponse)
 async def get_forgot_password(request: Request, current_user= Depends(get_current_user)):
     if current_user:
         return RedirectResponse(url="/home?msg=You are already logged in", status_code=303)
     return render_templates("forgot_password.html", request)
 
 
-@app.post("/forgot-password")
+@router.post("/forgot-password")
 async def forgot_password(request: Request, option: str = Form(...), identifier: str = Form(...),
-                          security_question: str = Form(...), security_answer: str = Form(...)):
+                          security_question: str = Form(...), security_answer: str = Form(...),
+                          uow= Depends(get_unit_of_work)):
+    retry_after = await rate_limiter.check("forgot_password", client_ip(request), identifier)
+    if retry_after:
+        return too_many_requests("forgot_password.html", request, retry_after)
     identifier = identifier.strip()
     if option == "email":
         identifier = identifier.lower()
 
     user = None
     if option == "email":
-        user = db.get_user_by_email(identifier)
+        user = await call_db(uow.db.get_user_by_email, identifier)
     elif option == "mobile":
-        user = db.get_user_by_mobile(identifier)
+        user = await call_db(uow.db.get_user_by_mobile, identifier)
 
     if not user:
         return templates.TemplateResponse("forgot_password.html", {"request": request, "error": "User not found"})
@@ -267,54 +478,65 @@ async def forgot_password(request: Request, option: str = Form(...), identifier:
     
     # Generate OTP
     otp = str(random.randint(100000, 999999))
-    otp_expiry = datetime.utcnow() + timedelta(minutes=3) # OTP valid for 3 minutes
-    db.update_otp(user.id, otp, otp_expiry)
+    await otp_store.issue(user.id, otp, Settings.OTP_TTL_SECONDS, db=uow.db)
     subject = "Your OTP for Password Reset"
-    body = generate_otp_email(otp) #you otp is {otp} and valid for 3 minutes
-    if not send_email(user.email, subject, body):
+    body = generate_otp_email(otp, expiry=max(1, Settings.OTP_TTL_SECONDS // 60))
+    if not email_queue.enqueue(user.email, subject, body):
         return templates.TemplateResponse("forgot_password.html", {"request": request, "error": "Failed to send OTP email"})
 
     return templates.TemplateResponse("verify_otp.html", {"request": request, "option": option, "identifier": identifier})
 
-@app.get("/reset-password", response_class=HTMLResponse)
+@router.get("/reset-password", response_class=HTMLResponse)
 async def get_reset_password(request: Request, current_user= Depends(get_current_user)):
     if current_user:
         return RedirectResponse(url="/home?msg=You are already logged in", status_code=303)
     # If accessed directly, redirect to forgot-password
     return RedirectResponse(url="/forgot-password?msg=Please verify first", status_code=303)
 
-@app.post("/reset-password")
-async def reset_password(request: Request, option: str = Form(...), identifier: str = Form(...), new_password: str = Form(...), confirm_password: str = Form(...)):
+@router.post("/reset-password")
+async def reset_password(request: Request, option: str = Form(...), identifier: str = Form(...), new_password: str = Form(...), confirm_password: str = Form(...),
+                         uow= Depends(get_unit_of_work)):
     if new_password != confirm_password:
         return templates.TemplateResponse("reset_password.html",{
             "request": request, "error": "Passwords do not match", "option": option, "identifier": identifier}
         )
-    hashed_password = get_password_hash(new_password)
+    try:
+        await uow.release()
+        hashed_password = await hash_password_async(new_password)
+    except HashingBusy:
+        return templates.TemplateResponse("reset_password.html",{
+            "request": request, "error": BUSY_MESSAGE, "option": option, "identifier": identifier}, status_code=503
+        )
 
     # Get user by email or mobile
     user = None
     if option == "email":
-        user = db.get_user_by_email(identifier.strip().lower())
+        user = await call_db(uow.db.get_user_by_email, identifier.strip().lower())
     elif option == "mobile":
-        user = db.get_user_by_mobile(identifier.strip())
+        user = await call_db(uow.db.get_user_by_mobile, identifier.strip())
 
     if not user:
         return templates.TemplateResponse("forgot_password.html", {"request": request, "error": "User not found", "option": option, "identifier": identifier}
         )
 
     # Update only password
-    db.update_password(user.id, hashed_password)
+    await call_db(uow.db.update_password, user.id, hashed_password)
+    await revocations.revoke_user(user.id, db=uow.db)
     return RedirectResponse(url="/?msg=Password reset successful", status_code=303)
 
-@app.get("/verify-otp", response_class=HTMLResponse)
+@router.get("/verify-otp", response_class=HTMLResponse)
 async def get_verify_otp(request: Request):
     # If accessed directly, redirect to forgot-password
     return RedirectResponse(url="/forgot-password", status_code=303)
 
-@app.post("/verify-otp")
-async def verify_otp(request: Request, option: Optional[str] = Form(None), identifier: Optional[str] = Form(None), otp: str = Form(...)):
+@router.post("/verify-otp")
+async def verify_otp(request: Request, option: Optional[str] = Form(None), identifier: Optional[str] = Form(None), otp: str = Form(...),
+                     uow= Depends(get_unit_of_work)):
     if not option or not identifier:
         return RedirectResponse(url="/forgot-password", status_code=303)
+    retry_after = await rate_limiter.check("verify_otp", client_ip(request), identifier)
+    if retry_after:
+        return too_many_requests("verify_otp.html", request, retry_after, option=option, identifier=identifier)
 
     identifier = identifier.strip()
     if option == "email":
@@ -322,22 +544,56 @@ async def verify_otp(request: Request, option: Optional[str] = Form(None), ident
 
     user = None
     if option == "email":
-        user = db.get_user_by_email(identifier)
+        user = await call_db(uow.db.get_user_by_email, identifier)
     elif option == "mobile":
-        user = db.get_user_by_mobile(identifier)
+        user = await call_db(uow.db.get_user_by_mobile, identifier)
 
-    if not user or user.otp != otp.strip():
+    # Verifying consumes the OTP, so it cannot be replayed
+    result = await otp_store.verify(user.id, otp.strip(), db=uow.db) if user else "invalid"
+    if result == "expired":
+        return templates.TemplateResponse("forgot_password.html", {"request": request, "option": option, "identifier": identifier, "error": "OTP has expired"})
+    if result == "locked":
+        return templates.TemplateResponse("forgot_password.html", {"request": request, "option": option, "identifier": identifier, "error": "Too many invalid attempts, please request a new OTP"})
+    if result != "ok":
         # OTP invalid, stay on the same page with error
         return templates.TemplateResponse("verify_otp.html", {"request": request, "option": option, "identifier": identifier, "error": "Invalid OTP"})
 
-    if datetime.utcnow() > user.otp_expiry:
-        db.update_otp(user.id, None, None)
-        return templates.TemplateResponse("forgot_password.html", {"request": request, "option": option, "identifier": identifier, "error": "OTP has expired"})
-    
-    # OTP matched, clear it
-    db.update_otp(user.id, None, None)
-
     # Redirect to login page with optional message
     return templates.TemplateResponse("reset_password.html",{
         "request": request, "option": option, "identifier": identifier, "username": user.username}
     )
+
+
+#--- Application factory ---
+# Engines, templates and background workers are built here rather than at import, so forking
+# workers, collecting tests or importing the module for a CLI does not touch the DB
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_engines()
+    load_templates()
+    email_queue.start()
+    await revocations.start()
+    await otp_store.start()
+    await user_purger.start()
+    await change_feed.start()
+    try:
+        yield
+    finally:
+        await change_feed.stop()
+        await user_purger.stop()
+        await otp_store.stop()
+        await revocations.stop()
+        await email_queue.stop()
+        hasher.shutdown()
+        await dispose_engines()
+
+def create_app() -> FastAPI:
+    app = FastAPI(lifespan=lifespan)
+    app.mount("/static", static_files, name="static")
+    # Added first so it runs inside the instrumentation, which then times the compression too
+    app.add_middleware(CompressionMiddleware)
+    app.add_middleware(InstrumentationMiddleware)
+    app.include_router(router)
+    return app
+
+app = create_app()
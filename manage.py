@@ -0,0 +1,48 @@
+"""
+Schema commands. The app never creates or alters tables on import or startup; run one of these
+before starting the workers:
+
+    python manage.py migrate              # alembic upgrade head (existing and production databases)
+    python manage.py migrate --sql        # print the DDL instead of running it
+    python manage.py create-schema        # fresh test database: create every table, mark it migrated
+"""
+import argparse
+import os
+from alembic import command
+from alembic.config import Config
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def alembic_config() -> Config:
+    return Config(os.path.join(ROOT, "alembic.ini"))
+
+
+def migrate(revision: str = "head", sql: bool = False):
+    command.upgrade(alembic_config(), revision, sql=sql)
+
+
+# Faster than replaying every migration, for empty databases only
+def create_schema():
+    import database
+    database.create_schema()
+    command.stamp(alembic_config(), "head")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Database schema commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = commands.add_parser("migrate", help="apply migrations up to a revision")
+    migrate_parser.add_argument("revision", nargs="?", default="head")
+    migrate_parser.add_argument("--sql", action="store_true", help="print the SQL instead of running it")
+    commands.add_parser("create-schema", help="create all tables in an empty database")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        migrate(args.revision, args.sql)
+    else:
+        create_schema()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Baseline schema: users, token_revocations and password_otps
+
+Databases created earlier by Base.metadata.create_all already have some or all of these
+tables, so every table and index is only created when it is missing.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def existing_schema():
+    if context.is_offline_mode():
+        return set(), {}
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+    indexes = {table: {index["name"] for index in inspector.get_indexes(table)} for table in tables}
+    return tables, indexes
+
+
+def upgrade():
+    tables, indexes = existing_schema()
+
+    if "users" not in tables:
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+            sa.Column("first_name", sa.String(50)),
+            sa.Column("last_name", sa.String(50)),
+            sa.Column("username", sa.String(50), unique=True),
+            sa.Column("email", sa.String(100), unique=True),
+            sa.Column("mobile", sa.String(15), unique=True),
+            sa.Column("password", sa.String(100)),
+            sa.Column("security_question", sa.String(100)),
+            sa.Column("security_answer", sa.String(100)),
+            sa.Column("created_at", sa.String(50)),
+            sa.Column("updated_at", sa.String(50)),
+            sa.Column("created_by", sa.String(50)),
+            sa.Column("updated_by", sa.String(50)),
+            sa.Column("otp", sa.String(6), nullable=True),
+            sa.Column("otp_expiry", sa.DateTime, nullable=True),
+        )
+    user_indexes = indexes.get("users", set())
+    if "ix_users_last_first" not in user_indexes:
+        op.create_index("ix_users_last_first", "users", ["last_name", "first_name"])
+    if "ix_users_first_name" not in user_indexes:
+        op.create_index("ix_users_first_name", "users", ["first_name"])
+
+    if "token_revocations" not in tables:
+        op.create_table(
+            "token_revocations",
+            sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+            sa.Column("jti", sa.String(64), nullable=True),
+            sa.Column("user_id", sa.Integer, nullable=True),
+            sa.Column("revoked_before", sa.Double, nullable=True),
+            sa.Column("expires_at", sa.Double, nullable=False),
+        )
+    if "ix_token_revocations_expires_at" not in indexes.get("token_revocations", set()):
+        op.create_index("ix_token_revocations_expires_at", "token_revocations", ["expires_at"])
+
+    if "password_otps" not in tables:
+        op.create_table(
+            "password_otps",
+            sa.Column("user_id", sa.Integer, primary_key=True, autoincrement=False),
+            sa.Column("otp", sa.String(6), nullable=False),
+            sa.Column("expires_at", sa.DateTime, nullable=False),
+            sa.Column("attempts", sa.Integer, nullable=False),
+        )
+    if "ix_password_otps_expires_at" not in indexes.get("password_otps", set()):
+        op.create_index("ix_password_otps_expires_at", "password_otps", ["expires_at"])
+
+
+def downgrade():
+    op.drop_table("password_otps")
+    op.drop_table("token_revocations")
+    op.drop_table("users")
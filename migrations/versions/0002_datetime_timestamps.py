@@ -0,0 +1,102 @@
+"""Store users.created_at/updated_at as DATETIME and index them
+
+The ISO strings are copied into new DATETIME columns in batches of
+Settings.MIGRATION_BATCH_SIZE rows, each committed on its own, so no long transaction
+holds row locks on a large users table while the app keeps serving. A catch-up pass then
+walks the table again and re-copies the rows inserted or updated meanwhile (those whose
+new columns do not match the old ones), right before the old columns are dropped and the
+new ones renamed; MySQL 8 runs these as online (INPLACE/INSTANT) DDL, SQLite copies the
+table. A write landing between the catch-up pass and the swap still loses its timestamps,
+so stop writes first when that short window matters.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+from datetime import datetime
+from alembic import context, op
+import sqlalchemy as sa
+from settings import Settings
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def parse_timestamp(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def format_timestamp(value):
+    return value.isoformat() if value is not None else None
+
+
+# Copy (created_at, updated_at) from one pair of columns to another, walking the table by id. With changed_only,
+# only the rows whose target columns differ from their converted source are written (the catch-up pass)
+def copy_timestamps(source, target, source_type, target_type, convert, batch_size=Settings.MIGRATION_BATCH_SIZE,
+                    changed_only=False):
+    users = sa.table("users", sa.column("id", sa.Integer),
+                     sa.column(source[0], source_type), sa.column(source[1], source_type),
+                     sa.column(target[0], target_type), sa.column(target[1], target_type))
+    if context.is_offline_mode():
+        if changed_only:  # the offline script copies every row in one statement
+            return
+        op.execute(users.update().values({target[0]: sa.cast(users.c[source[0]], target_type),
+                                          target[1]: sa.cast(users.c[source[1]], target_type)}))
+        return
+    bind = op.get_bind()
+    statement = users.update().where(users.c.id == sa.bindparam("row_id")).values(
+        {target[0]: sa.bindparam("created"), target[1]: sa.bindparam("updated")})
+    last_id = 0
+    with context.get_context().autocommit_block():
+        while True:
+            rows = bind.execute(sa.select(users.c.id, users.c[source[0]], users.c[source[1]],
+                                          users.c[target[0]], users.c[target[1]])
+                                .where(users.c.id > last_id).order_by(users.c.id).limit(batch_size)).all()
+            if not rows:
+                break
+            values = [{"row_id": row[0], "created": convert(row[1]), "updated": convert(row[2])} for row in rows]
+            if changed_only:
+                values = [value for value, row in zip(values, rows)
+                          if (value["created"], value["updated"]) != (row[3], row[4])]
+            if values:
+                bind.execute(statement, values)
+            last_id = rows[-1][0]
+
+
+def upgrade():
+    op.add_column("users", sa.Column("created_at_dt", sa.DateTime, nullable=True))
+    op.add_column("users", sa.Column("updated_at_dt", sa.DateTime, nullable=True))
+    copy_timestamps(("created_at", "updated_at"), ("created_at_dt", "updated_at_dt"),
+                    sa.String(50), sa.DateTime(), parse_timestamp)
+    copy_timestamps(("created_at", "updated_at"), ("created_at_dt", "updated_at_dt"),
+                    sa.String(50), sa.DateTime(), parse_timestamp, changed_only=True)
+    with op.batch_alter_table("users") as batch:
+        batch.drop_column("created_at")
+        batch.drop_column("updated_at")
+        batch.alter_column("created_at_dt", new_column_name="created_at", existing_type=sa.DateTime)
+        batch.alter_column("updated_at_dt", new_column_name="updated_at", existing_type=sa.DateTime)
+    op.create_index("ix_users_created_at", "users", ["created_at"])
+    op.create_index("ix_users_updated_at", "users", ["updated_at"])
+
+
+def downgrade():
+    op.drop_index("ix_users_updated_at", table_name="users")
+    op.drop_index("ix_users_created_at", table_name="users")
+    op.add_column("users", sa.Column("created_at_str", sa.String(50), nullable=True))
+    op.add_column("users", sa.Column("updated_at_str", sa.String(50), nullable=True))
+    copy_timestamps(("created_at", "updated_at"), ("created_at_str", "updated_at_str"),
+                    sa.DateTime(), sa.String(50), format_timestamp)
+    copy_timestamps(("created_at", "updated_at"), ("created_at_str", "updated_at_str"),
+                    sa.DateTime(), sa.String(50), format_timestamp, changed_only=True)
+    with op.batch_alter_table("users") as batch:
+        batch.drop_column("created_at")
+        batch.drop_column("updated_at")
+        batch.alter_column("created_at_str", new_column_name="created_at", existing_type=sa.String(50))
+        batch.alter_column("updated_at_str", new_column_name="updated_at", existing_type=sa.String(50))
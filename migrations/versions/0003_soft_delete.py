@@ -0,0 +1,29 @@
+"""Add users.deleted_at for soft deletes
+
+Deleted users are marked with a timestamp and hard-deleted later by the background purger.
+The column is nullable with no default, so MySQL 8 adds it INSTANT; the index serves the
+purger's scan for rows deleted before a cutoff.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("users") as batch:
+        batch.add_column(sa.Column("deleted_at", sa.DateTime(), nullable=True))
+        batch.create_index("ix_users_deleted_at", ["deleted_at"])
+
+
+def downgrade():
+    with op.batch_alter_table("users") as batch:
+        batch.drop_index("ix_users_deleted_at")
+        batch.drop_column("deleted_at")
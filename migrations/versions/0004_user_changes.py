@@ -0,0 +1,34 @@
+"""Add the user_changes table, the change log (outbox) of the users table
+
+Every user write inserts its change rows in the same transaction, and consumers tail the table by id
+through GET /users/changes. The user_id index serves the history of one user.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "user_changes",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("user_id", sa.Integer, nullable=False),
+        sa.Column("operation", sa.String(10), nullable=False),
+        sa.Column("fields", sa.String(255), nullable=True),
+        sa.Column("changed_at", sa.DateTime, nullable=False),
+        sa.Column("changed_by", sa.String(50), nullable=True),
+    )
+    op.create_index("ix_user_changes_user_id", "user_changes", ["user_id"])
+
+
+def downgrade():
+    op.drop_index("ix_user_changes_user_id", table_name="user_changes")
+    op.drop_table("user_changes")
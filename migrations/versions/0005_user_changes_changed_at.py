@@ -0,0 +1,23 @@
+"""Index user_changes.changed_at for pruning
+
+The change log keeps CHANGE_LOG_RETENTION_DAYS of history; the index serves the pruning scan for rows
+recorded before the cutoff.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_user_changes_changed_at", "user_changes", ["changed_at"])
+
+
+def downgrade():
+    op.drop_index("ix_user_changes_changed_at", table_name="user_changes")
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import math
+import time
+from datetime import datetime, timedelta
+from async_crud import call_db
+from settings import Settings
+
+
+class MemoryOTPStore:
+    """
+    Per-process OTP store. Entries are bucketed by expiry second (a timing wheel) so expired
+    OTPs are dropped a bucket at a time, and the oldest are evicted once max_entries is reached.
+    Only suitable for a single worker; use TableOTPStore when several workers serve requests.
+    Args:
+        max_attempts (int): Wrong guesses allowed before the OTP is discarded.
+        max_entries (int): Upper bound on pending OTPs.
+    """
+
+    def __init__(self, max_attempts: int = Settings.OTP_MAX_ATTEMPTS, max_entries: int = Settings.OTP_MAX_ENTRIES):
+        self.max_attempts = max_attempts
+        self.max_entries = max_entries
+        self._entries = {}  # user id -> [otp, expires_at, attempts]
+        self._wheel = {}    # expiry second -> user ids
+        self.counts = {"issued": 0, "verified": 0, "invalid": 0, "expired": 0, "locked": 0, "evicted": 0}
+
+    async def issue(self, user_id: int, otp: str, ttl: float = Settings.OTP_TTL_SECONDS, db=None):
+        now = time.monotonic()
+        self._expire(now)
+        if user_id not in self._entries:
+            while self._entries and len(self._entries) >= self.max_entries:
+                self._evict_oldest()
+        expires_at = now + ttl
+        self._entries[user_id] = [otp, expires_at, 0]
+        self._wheel.setdefault(math.ceil(expires_at), set()).add(user_id)
+        self.counts["issued"] += 1
+
+    # Verify and consume; returns "ok", "invalid", "expired" or "locked". db is only used by TableOTPStore
+    async def verify(self, user_id: int, otp: str, db=None) -> str:
+        now = time.monotonic()
+        entry = self._entries.get(user_id)
+        if entry is None:
+            status = "invalid"
+        elif entry[0] == otp:
+            status = "ok" if entry[1] > now else "expired"
+        else:
+            entry[2] += 1
+            status = "locked" if entry[2] >= self.max_attempts else "invalid"
+        if status != "invalid":
+            self._entries.pop(user_id, None)
+        self.counts["verified" if status == "ok" else status] += 1
+        return status
+
+    def _expire(self, now: float):
+        for second in [s for s in self._wheel if s <= now]:
+            for user_id in self._wheel.pop(second):
+                entry = self._entries.get(user_id)
+                # The user may have been issued a newer OTP that lives in a later bucket
+                if entry is not None and entry[1] <= now:
+                    del self._entries[user_id]
+
+    def _evict_oldest(self):
+        if not self._wheel:
+            self._entries.clear()
+            return
+        for user_id in self._wheel.pop(min(self._wheel)):
+            if self._entries.pop(user_id, None) is not None:
+                self.counts["evicted"] += 1
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "pending": len(self._entries), **self.counts}
+
+
+class TableOTPStore:
+    """
+    OTP store backed by the compact password_otps table, shared by all workers.
+    Verification is a single conditional DELETE, so an OTP can only be consumed once, and a
+    background task purges expired rows in batches along the expires_at index.
+    Args:
+        db: CRUD or AsyncCRUD.
+        max_attempts (int): Wrong guesses allowed before the OTP is discarded.
+        purge_interval (float): Seconds between purge runs.
+        purge_batch (int): Rows deleted per purge statement.
+    """
+
+    def __init__(self, db, max_attempts: int = Settings.OTP_MAX_ATTEMPTS,
+                 purge_interval: float = Settings.OTP_PURGE_SECONDS, purge_batch: int = Settings.OTP_PURGE_BATCH):
+        self.db = db
+        self.max_attempts = max_attempts
+        self.purge_interval = purge_interval
+        self.purge_batch = purge_batch
+        self._task = None
+        self.counts = {"issued": 0, "verified": 0, "invalid": 0, "expired": 0, "locked": 0, "purged": 0}
+
+    # db, when given, is a request's bound CRUD so the write joins its unit of work
+    async def issue(self, user_id: int, otp: str, ttl: float = Settings.OTP_TTL_SECONDS, db=None):
+        await call_db((db or self.db).issue_otp, user_id, otp, datetime.utcnow() + timedelta(seconds=ttl))
+        self.counts["issued"] += 1
+
+    # Verify and consume; returns "ok", "invalid", "expired" or "locked"
+    async def verify(self, user_id: int, otp: str, db=None) -> str:
+        status = await call_db((db or self.db).consume_otp, user_id, otp, datetime.utcnow(), self.max_attempts)
+        self.counts["verified" if status == "ok" else status] += 1
+        return status
+
+    # Delete expired OTPs batch by batch so no single statement holds locks for long
+    async def purge(self) -> int:
+        total = 0
+        while True:
+            removed = await call_db(self.db.purge_otps, datetime.utcnow(), self.purge_batch)
+            total += removed
+            if removed < self.purge_batch:
+                break
+        self.counts["purged"] += total
+        return total
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.purge_interval)
+            try:
+                await self.purge()
+            except Exception as e:
+                logging.error(f"OTP purge failed: {e}")
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"backend": "table", **self.counts}
+
+
+def make_otp_store(db):
+    if Settings.OTP_BACKEND == "memory":
+        return MemoryOTPStore()
+    return TableOTPStore(db)
@@ -0,0 +1,108 @@
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+
+class PoolMetrics:
+    """Connection pool counters collected from SQLAlchemy pool events."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools = []
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connects = 0
+            self.checkouts = 0
+            self.checkins = 0
+            self.invalidations = 0
+            self.soft_invalidations = 0
+            self.timeouts = 0
+            self.wait_seconds_total = 0.0
+            self.wait_seconds_max = 0.0
+
+    # Register the pool event listeners on an engine (sync or async)
+    def attach(self, engine):
+        engine = getattr(engine, "sync_engine", engine)
+        event.listen(engine, "connect", self._on_connect)
+        event.listen(engine, "checkout", self._on_checkout)
+        event.listen(engine, "checkin", self._on_checkin)
+        event.listen(engine, "invalidate", self._on_invalidate)
+        event.listen(engine, "soft_invalidate", self._on_soft_invalidate)
+        self._pools.append(engine.pool)
+
+    def record_wait(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def _increment(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        self._increment("connects")
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self._increment("checkouts")
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        self._increment("checkins")
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        self._increment("invalidations")
+
+    def _on_soft_invalidate(self, dbapi_connection, connection_record, exception):
+        self._increment("soft_invalidations")
+
+    def stats(self) -> dict:
+        pools = []
+        for pool in self._pools:
+            if isinstance(pool, QueuePool):
+                pools.append({"size": pool.size(), "checked_in": pool.checkedin(),
+                              "checked_out": pool.checkedout(), "overflow": pool.overflow()})
+            else:
+                pools.append({"status": pool.status()})
+        with self._lock:
+            checkouts = self.checkouts or 1
+            return {
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "invalidations": self.invalidations,
+                "soft_invalidations": self.soft_invalidations,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": round(self.wait_seconds_total / checkouts * 1000, 3),
+                "max_wait_ms": round(self.wait_seconds_max * 1000, 3),
+                "pools": pools,
+            }
+
+
+pool_metrics = PoolMetrics()
+
+
+class _TimedPoolMixin:
+    """Measures how long callers wait to get a connection out of the pool."""
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            pool_metrics.record_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        pool_metrics.record_wait(time.perf_counter() - started)
+        return connection
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
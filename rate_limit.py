@@ -0,0 +1,127 @@
+import threading
+import time
+from collections import OrderedDict
+from settings import Settings
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # optional, only needed for RATE_LIMIT_BACKEND=redis
+    redis_asyncio = None
+
+
+class Rate:
+    """Token bucket parameters parsed from "<requests>/<seconds>", e.g. "5/60"."""
+
+    def __init__(self, spec: str):
+        requests, seconds = spec.split("/")
+        self.capacity = float(requests)
+        self.refill_per_second = float(requests) / float(seconds)
+
+
+class MemoryBackend:
+    """Token buckets kept in this process; the oldest keys are dropped beyond max_keys."""
+
+    def __init__(self, max_keys: int = Settings.RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    async def take(self, key: str, rate: Rate):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (rate.capacity, now))
+            tokens = min(rate.capacity, tokens + (now - updated_at) * rate.refill_per_second)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        retry_after = 0.0 if allowed else (1 - tokens) / rate.refill_per_second
+        return allowed, retry_after
+
+
+# Atomic token bucket: KEYS[1] bucket, ARGV capacity, refill per second, now; returns {allowed, retry_after_ms}
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + (now - updated_at) * refill)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / refill * 1000))
+local retry_after = 0
+if allowed == 0 then
+    retry_after = math.ceil((1 - tokens) / refill * 1000)
+end
+return {allowed, retry_after}
+"""
+
+
+class RedisBackend:
+    """Token buckets shared by all workers through Redis (needs the redis package)."""
+
+    def __init__(self, url: str = Settings.REDIS_URL):
+        if redis_asyncio is None:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the 'redis' package")
+        self._client = redis_asyncio.from_url(url)
+        self._script = self._client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def take(self, key: str, rate: Rate):
+        allowed, retry_after_ms = await self._script(
+            keys=[f"ratelimit:{key}"], args=[rate.capacity, rate.refill_per_second, time.time()])
+        return bool(allowed), retry_after_ms / 1000
+
+
+class RateLimiter:
+    """
+    Token-bucket limits per client IP and per identifier (username, email or mobile) for each rule.
+    Checked before any DB or hashing work so rejected requests stay cheap.
+    Args:
+        rules (dict): rule name -> {"ip": "<requests>/<seconds>", "identifier": "<requests>/<seconds>"}.
+        backend: MemoryBackend or RedisBackend.
+    """
+
+    def __init__(self, rules: dict, backend=None):
+        self.rules = {name: {scope: Rate(spec) for scope, spec in limits.items()} for name, limits in rules.items()}
+        self.backend = backend or make_backend()
+        self.rejected = {name: 0 for name in rules}
+        self._lock = threading.Lock()
+
+    # Returns 0 when the request may proceed, otherwise the seconds to wait before retrying
+    async def check(self, rule: str, ip: str, identifier: str = None) -> float:
+        limits = self.rules[rule]
+        keys = [("ip", ip)]
+        if identifier:
+            keys.append(("identifier", identifier.strip().lower()))
+        for scope, value in keys:
+            allowed, retry_after = await self.backend.take(f"{rule}:{scope}:{value}", limits[scope])
+            if not allowed:
+                with self._lock:
+                    self.rejected[rule] += 1
+                return max(retry_after, 1.0)
+        return 0.0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {f"{name}_rejected": count for name, count in self.rejected.items()}
+
+
+def make_backend():
+    if Settings.RATE_LIMIT_BACKEND == "redis":
+        return RedisBackend()
+    return MemoryBackend()
+
+
+rate_limiter = RateLimiter({
+    "login": {"ip": Settings.RATE_LIMIT_LOGIN_IP, "identifier": Settings.RATE_LIMIT_LOGIN_IDENTIFIER},
+    "forgot_password": {"ip": Settings.RATE_LIMIT_FORGOT_IP, "identifier": Settings.RATE_LIMIT_FORGOT_IDENTIFIER},
+    "verify_otp": {"ip": Settings.RATE_LIMIT_OTP_IP, "identifier": Settings.RATE_LIMIT_OTP_IDENTIFIER},
+})
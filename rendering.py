@@ -0,0 +1,91 @@
+import hashlib
+import time
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from markupsafe import Markup
+from fastapi.responses import StreamingResponse
+from fastapi.templating import Jinja2Templates
+from settings import Settings
+from instrumentation import record, timed
+
+# Static pieces of base.html rendered once and injected as ready-made markup
+PRERENDERED_FRAGMENTS = {
+    "styles": "partials/styles.html",
+    "footer": "partials/footer.html",
+}
+
+# Bytes buffered before a streamed page is flushed to the client
+STREAM_CHUNK_SIZE = 16 * 1024
+
+
+# Asset URLs when no fingerprinted static files are given (benchmarks)
+def plain_static_url(path: str) -> str:
+    return f"/static/{path}"
+
+
+def build_environment(directory: str = Settings.TEMPLATE_DIR, auto_reload: bool = Settings.TEMPLATE_AUTO_RELOAD,
+                      static_url=plain_static_url):
+    """Jinja environment with compiled templates kept in memory; auto-reload stays off outside development.
+    static_url(path) builds the URL of a static asset (http_cache.FingerprintedStaticFiles.url)."""
+    env = Environment(
+        loader=FileSystemLoader(directory),
+        autoescape=select_autoescape(["html", "xml"]),
+        auto_reload=auto_reload,
+        cache_size=-1,
+    )
+    env.globals["static_url"] = static_url
+    env.globals["prerendered"] = {
+        name: Markup(env.get_template(path).render().strip())
+        for name, path in PRERENDERED_FRAGMENTS.items()
+    }
+    return env
+
+
+class TimedTemplates(Jinja2Templates):
+    """Jinja2Templates that reports rendering time to the request instrumentation."""
+
+    def TemplateResponse(self, *args, **kwargs):
+        with timed("render"):
+            return super().TemplateResponse(*args, **kwargs)
+
+
+# Compile every template up front so the first request does not pay for it
+def warm_templates(env) -> int:
+    names = env.list_templates(extensions=["html"])
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+# Hash of every template's source and of the prerendered fragments (which hold the asset fingerprints); part of
+# page ETags, so a deploy with changed templates or assets invalidates them
+def template_version(env) -> str:
+    digest = hashlib.sha256()
+    for name in sorted(env.list_templates(extensions=["html"])):
+        digest.update(env.loader.get_source(env, name)[0].encode())
+    for name in sorted(env.globals["prerendered"]):
+        digest.update(env.globals["prerendered"][name].encode())
+    return digest.hexdigest()[:12]
+
+
+# Render a template with generate() and send it in chunks instead of one big string
+def stream_template(env, name: str, context: dict, status_code: int = 200) -> StreamingResponse:
+    template = env.get_template(name)
+
+    def chunks():
+        buffer = []
+        size = 0
+        started = time.perf_counter()
+        for piece in template.generate(context):
+            buffer.append(piece)
+            size += len(piece)
+            if size >= STREAM_CHUNK_SIZE:
+                record("render", time.perf_counter() - started)
+                yield "".join(buffer)
+                buffer = []
+                size = 0
+                started = time.perf_counter()
+        record("render", time.perf_counter() - started)
+        if buffer:
+            yield "".join(buffer)
+
+    return StreamingResponse(chunks(), status_code=status_code, media_type="text/html")
@@ -0,0 +1,92 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from sqlalchemy.exc import OperationalError, InterfaceError, TimeoutError as PoolTimeoutError
+from settings import Settings
+
+# Failures that mean the replica (not the query) is at fault; the read is retried on the primary
+REPLICA_ERRORS = (OperationalError, InterfaceError, PoolTimeoutError)
+
+LATENCY_SMOOTHING = 0.2
+
+
+@dataclass
+class Replica:
+    name: str
+    engine: object
+    Session: object
+    latency: float = 0.0       # moving average of query time in seconds
+    down_until: float = 0.0
+    reads: int = 0
+    failures: int = 0
+
+
+class ReplicaSet:
+    """
+    Read replicas and the choice of which one serves the next read.
+    "round_robin" rotates through the healthy replicas, "latency" picks the one with the lowest
+    moving-average query time. A replica whose query fails is left out for `retry_seconds`,
+    and reads go to the primary while no replica is healthy.
+    Args:
+        selection (str): "round_robin" or "latency".
+        retry_seconds (float): How long a failed replica is skipped.
+    """
+
+    def __init__(self, selection: str = Settings.REPLICA_SELECTION, retry_seconds: float = Settings.REPLICA_RETRY_SECONDS):
+        self.selection = selection
+        self.retry_seconds = retry_seconds
+        self.replicas = []
+        self.fallbacks = 0
+        self._turn = 0
+        self._lock = threading.Lock()
+
+    def add(self, name: str, engine, session_factory):
+        self.replicas.append(Replica(name=name, engine=engine, Session=session_factory))
+
+    # Replica for the next read, or None to read from the primary
+    def pick(self):
+        if not self.replicas:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            healthy = [replica for replica in self.replicas if replica.down_until <= now]
+            if not healthy:
+                self.fallbacks += 1
+                return None
+            if self.selection == "latency":
+                replica = min(healthy, key=lambda candidate: candidate.latency)
+            else:
+                replica = healthy[self._turn % len(healthy)]
+                self._turn += 1
+            replica.reads += 1
+            return replica
+
+    def observe(self, replica: Replica, seconds: float):
+        with self._lock:
+            if replica.latency == 0.0:
+                replica.latency = seconds
+            else:
+                replica.latency += LATENCY_SMOOTHING * (seconds - replica.latency)
+
+    def mark_down(self, replica: Replica, error: Exception):
+        logging.warning(f"Read replica {replica.name} failed, using the primary for {self.retry_seconds}s: {error}")
+        with self._lock:
+            replica.failures += 1
+            replica.down_until = time.monotonic() + self.retry_seconds
+            self.fallbacks += 1
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "replicas": len(self.replicas),
+                "healthy": sum(1 for replica in self.replicas if replica.down_until <= now),
+                "reads": sum(replica.reads for replica in self.replicas),
+                "failures": sum(replica.failures for replica in self.replicas),
+                "fallbacks": self.fallbacks,
+                "selection": self.selection,
+                "detail": [{"name": replica.name, "healthy": replica.down_until <= now, "reads": replica.reads,
+                            "failures": replica.failures, "latency_ms": round(replica.latency * 1000, 3)}
+                           for replica in self.replicas],
+            }
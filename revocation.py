@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import threading
+import time
+from async_crud import call_db
+from change_feed import ChangeCursor
+from jwt_utils import ACCESS_TOKEN_EXPIRE_MINUTES
+from settings import Settings
+
+PURGE_INTERVAL_SECONDS = 600
+
+
+class TokenRevocations:
+    """
+    In-memory denylist of revoked access tokens, checked without any I/O.
+    Revocations are written to the token_revocations table and every worker pulls new rows
+    every `sync_interval` seconds, so a logout on one worker reaches the others within that interval.
+    Rows are inserted in the request's transaction, so a lower id can commit after a higher one was synced;
+    the ChangeCursor reads the skipped ids again until they appear.
+    Args:
+        db: CRUD or AsyncCRUD used to persist and sync revocations.
+        sync_interval (float): Seconds between syncs.
+    """
+
+    def __init__(self, db, sync_interval: float = Settings.REVOCATION_SYNC_SECONDS):
+        self.db = db
+        self.sync_interval = sync_interval
+        self._tokens = {}   # jti -> expires_at
+        self._users = {}    # user id -> (revoked_before, expires_at)
+        self._cursor = ChangeCursor(0)
+        self._last_purge = 0.0
+        self._lock = threading.Lock()
+        self._task = None
+
+    # O(1) check of a decoded token payload
+    def is_revoked(self, payload: dict) -> bool:
+        jti = payload.get("jti")
+        if jti is not None and jti in self._tokens:
+            return True
+        revoked = self._users.get(payload.get("uid"))
+        if revoked is None:
+            return False
+        return payload.get("iat", 0) < revoked[0]
+
+    # Revoke one token (logout). db, when given, is a request's bound CRUD so the write joins its unit of work
+    async def revoke_token(self, payload: dict, db=None):
+        jti = payload.get("jti")
+        if jti is None:
+            return
+        expires_at = float(payload.get("exp", time.time() + ACCESS_TOKEN_EXPIRE_MINUTES * 60))
+        self._remember(jti=jti, expires_at=expires_at)
+        await call_db((db or self.db).add_revocation, expires_at, jti=jti)
+
+    # Revoke every token issued to a user so far (password reset, deletion)
+    async def revoke_user(self, user_id: int, db=None):
+        await self.revoke_users([user_id], db=db)
+
+    # revoke_user for several users, persisted in one statement (bulk delete)
+    async def revoke_users(self, user_ids, db=None):
+        now = time.time()
+        expires_at = now + ACCESS_TOKEN_EXPIRE_MINUTES * 60
+        for user_id in user_ids:
+            self._remember(user_id=user_id, revoked_before=now, expires_at=expires_at)
+        await call_db((db or self.db).add_user_revocations, user_ids, now, expires_at)
+
+    def _remember(self, expires_at: float, jti: str = None, user_id: int = None, revoked_before: float = None):
+        with self._lock:
+            if jti is not None:
+                self._tokens[jti] = expires_at
+            if user_id is not None:
+                current = self._users.get(user_id)
+                if current is None or current[0] < revoked_before:
+                    self._users[user_id] = (revoked_before, expires_at)
+
+    # Pull revocations made by other workers and forget the ones that have expired
+    async def sync(self):
+        now = time.time()
+        rows = await call_db(self.db.revocations_since, self._cursor.last_id, now, sorted(self._cursor.gaps))
+        for row in self._cursor.advance(rows):
+            self._remember(row.expires_at, jti=row.jti, user_id=row.user_id, revoked_before=row.revoked_before)
+        with self._lock:
+            self._tokens = {jti: expires for jti, expires in self._tokens.items() if expires > now}
+            self._users = {uid: entry for uid, entry in self._users.items() if entry[1] > now}
+        if now - self._last_purge >= PURGE_INTERVAL_SECONDS:
+            self._last_purge = now
+            await call_db(self.db.purge_revocations, now)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                logging.error(f"Token revocation sync failed: {e}")
+
+    async def start(self):
+        await self.sync()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"revoked_tokens": len(self._tokens), "revoked_users": len(self._users),
+                "pending_gaps": len(self._cursor.gaps)}
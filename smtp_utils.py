@@ -2,12 +2,21 @@ import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from passkey import PassKey
+from settings import Settings
 import logging
 
 # Gmail credentials from environment variables for security
 SENDER_EMAIL = PassKey.SENDER_EMAIL
 EMAIL_PASSWORD = PassKey.EMAIL_PASSWORD
 
+def build_message(receiver_email: str, subject: str, body: str) -> MIMEMultipart:
+    message = MIMEMultipart()
+    message["From"] = SENDER_EMAIL
+    message["To"] = receiver_email
+    message["Subject"] = subject
+    message.attach(MIMEText(body, "html"))
+    return message
+
 def send_email(receiver_email: str, subject: str, body: str) -> bool:
     """
     Send an email using Gmail SMTP server.
@@ -17,11 +26,7 @@ def send_email(receiver_email: str, subject: str, body: str) -> bool:
         body (str): Email body text.
 
     """
-    message = MIMEMultipart()
-    message["From"] = SENDER_EMAIL
-    message["To"] = receiver_email
-    message["Subject"] = subject
-    message.attach(MIMEText(body, "html"))
+    message = build_message(receiver_email, subject, body)
 
     try:
         with smtplib.SMTP("smtp.gmail.com", 587) as server:
@@ -35,3 +40,64 @@ def send_email(receiver_email: str, subject: str, body: str) -> bool:
     except Exception as e:
         logging.error(f"Error sending email: {e}")
         return False
+
+
+class SMTPTransport:
+    """
+    One persistent, authenticated SMTP connection that is reopened when the server drops it.
+    Not thread-safe: each email worker owns its own transport.
+    """
+
+    def __init__(self, host: str = Settings.SMTP_HOST, port: int = Settings.SMTP_PORT,
+                 starttls: bool = Settings.SMTP_STARTTLS, login: bool = Settings.SMTP_LOGIN,
+                 timeout: float = Settings.SMTP_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.starttls = starttls
+        self.login = login
+        self.timeout = timeout
+        self._server = None
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            server.starttls()
+        if self.login:
+            server.login(SENDER_EMAIL, EMAIL_PASSWORD)
+        self._server = server
+
+    def send(self, receiver_email: str, subject: str, body: str):
+        message = build_message(receiver_email, subject, body).as_string()
+        if self._server is None:
+            self._connect()
+        try:
+            self._server.sendmail(SENDER_EMAIL, receiver_email, message)
+        except smtplib.SMTPServerDisconnected:
+            # Idle connection closed by the server; reconnect once and resend
+            self._connect()
+            self._server.sendmail(SENDER_EMAIL, receiver_email, message)
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._server = None
+
+
+class MemoryTransport:
+    """Keeps sent messages in a shared in-memory outbox instead of talking to a server."""
+    outbox = []
+
+    def send(self, receiver_email: str, subject: str, body: str):
+        self.outbox.append({"to": receiver_email, "subject": subject, "body": body})
+
+    def close(self):
+        pass
+
+
+def make_transport():
+    if Settings.EMAIL_BACKEND == "memory":
+        return MemoryTransport()
+    return SMTPTransport()
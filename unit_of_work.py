@@ -0,0 +1,51 @@
+from async_crud import call_db
+from crud import pending_invalidations
+
+
+class UnitOfWork:
+    """
+    One database session for one request. `db` is the app's CRUD (or AsyncCRUD) bound to that
+    session, so every call the request makes through it shares one connection checkout and one
+    transaction, and looking up the same user twice is answered from the session's identity map.
+    Each write runs in a savepoint; the transaction is committed when the request finishes and
+    rolled back if it raises. release() ends the transaction early, before a slow wait that needs no database.
+    Args:
+        db: The CRUD or AsyncCRUD to bind.
+    """
+
+    def __init__(self, db):
+        self.session = db.Session()
+        # Objects loaded before release() stay usable without being read again
+        self.session.expire_on_commit = False
+        self.db = db.bind(self.session)
+
+    # Users changed by the request leave the user cache only once the change is visible to other requests
+    async def commit(self):
+        await call_db(self.session.commit)
+        for user_id in pending_invalidations(self.session):
+            self.db.user_cache.invalidate(user_id)
+
+    async def rollback(self):
+        await call_db(self.session.rollback)
+        pending_invalidations(self.session)
+
+    # Commit what the request did so far and return the connection to the pool, so a request waiting on bcrypt
+    # does not hold a connection while it waits. The next CRUD call starts a new transaction
+    async def release(self):
+        if self.session.in_transaction():
+            await self.commit()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        # A request that never touched the database has no connection or transaction to end
+        if not self.session.in_transaction():
+            return
+        try:
+            if exc_type is None:
+                await self.commit()
+            else:
+                await self.rollback()
+        finally:
+            await call_db(self.session.close)
@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+from settings import Settings
+
+
+@dataclass(frozen=True)
+class UserSnapshot:
+    """Detached, read-only copy of the fields routes need about the logged-in user."""
+    id: int
+    first_name: str
+    last_name: str
+    username: str
+    email: str
+    mobile: str
+    security_question: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    created_by: Optional[str] = None
+    updated_by: Optional[str] = None
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(
+            id=user.id,
+            first_name=user.first_name,
+            last_name=user.last_name,
+            username=user.username,
+            email=user.email,
+            mobile=user.mobile,
+            security_question=user.security_question,
+            created_at=user.created_at,
+            updated_at=user.updated_at,
+            created_by=user.created_by,
+            updated_by=user.updated_by,
+        )
+
+
+class UserCache:
+    """
+    Bounded LRU cache of user snapshots keyed by username, with a TTL per entry.
+    Args:
+        max_size (int): Maximum number of cached users.
+        ttl (float): Seconds an entry stays valid.
+    """
+
+    def __init__(self, max_size: int = Settings.USER_CACHE_SIZE, ttl: float = Settings.USER_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # username -> (expires_at, snapshot)
+        self._usernames = {}  # user id -> username
+        self._lock = threading.Lock()
+
+    def get(self, username: str):
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, snapshot = entry
+            if expires_at < time.monotonic():
+                self._remove(username)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(username)
+            self.hits += 1
+            return snapshot
+
+    def put(self, user):
+        snapshot = UserSnapshot.from_user(user)
+        if self.max_size <= 0:
+            return snapshot
+        with self._lock:
+            self._invalidate_locked(snapshot.id)
+            if snapshot.username in self._entries:
+                self._remove(snapshot.username)
+            self._entries[snapshot.username] = (time.monotonic() + self.ttl, snapshot)
+            self._usernames[snapshot.id] = snapshot.username
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+        return snapshot
+
+    # Drop the cached entry for the given user id
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._invalidate_locked(user_id)
+
+    def _invalidate_locked(self, user_id: int):
+        username = self._usernames.get(user_id)
+        if username is not None:
+            self._remove(username)
+
+    def _remove(self, username: str):
+        _, snapshot = self._entries.pop(username)
+        self._usernames.pop(snapshot.id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._usernames.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries), "max_size": self.max_size,
+                    "hits": self.hits, "misses": self.misses}
+
+
+user_cache = UserCache()
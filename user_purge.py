@@ -0,0 +1,65 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from async_crud import call_db
+from settings import Settings
+
+
+class UserPurger:
+    """
+    Background hard delete of soft-deleted users. Every `interval` seconds it removes the users
+    deleted more than `after` seconds ago, `batch_size` rows per statement with `pause` seconds
+    between statements, so a large cleanup never holds row locks for long or crowds out live requests.
+    Args:
+        db: CRUD or AsyncCRUD.
+        interval (float): Seconds between purge runs.
+        after (float): How long a deleted user is kept before it is purged.
+        batch_size (int): Rows deleted per statement.
+        pause (float): Seconds to wait between two statements of one run.
+    """
+
+    def __init__(self, db, interval: float = Settings.USER_PURGE_SECONDS, after: float = Settings.USER_PURGE_AFTER_SECONDS,
+                 batch_size: int = Settings.USER_PURGE_BATCH, pause: float = Settings.USER_PURGE_PAUSE_SECONDS):
+        self.db = db
+        self.interval = interval
+        self.after = after
+        self.batch_size = batch_size
+        self.pause = pause
+        self._task = None
+        self.counts = {"runs": 0, "batches": 0, "purged": 0, "failures": 0}
+
+    # Purge everything deleted before the cutoff, batch by batch; returns how many users were removed
+    async def purge(self) -> int:
+        cutoff = datetime.now() - timedelta(seconds=self.after)
+        total = 0
+        while True:
+            removed = await call_db(self.db.purge_deleted, cutoff, self.batch_size)
+            self.counts["batches"] += 1
+            total += removed
+            if removed < self.batch_size:
+                break
+            await asyncio.sleep(self.pause)
+        self.counts["runs"] += 1
+        self.counts["purged"] += total
+        return total
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.purge()
+            except Exception as e:
+                self.counts["failures"] += 1
+                logging.error(f"User purge failed: {e}")
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"mode": Settings.DELETE_MODE, **self.counts}
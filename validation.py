@@ -1,33 +1,126 @@
+from dataclasses import dataclass
 from fastapi import HTTPException
 import re
+from typing import Optional, Pattern
+
+
+@dataclass(frozen=True)
+class Rule:
+    """Length bounds and a precompiled pattern for one kind of field, with their error messages.
+    Messages may contain {label}, filled in with the field's label by Schema."""
+    pattern: Optional[Pattern] = None
+    pattern_message: str = None
+    min_length: int = 0
+    max_length: Optional[int] = None
+    length_message: str = None
+
+    # Error message for value, or None when it is valid
+    def check(self, value: str, label: str = "It") -> Optional[str]:
+        if self.max_length is not None and not (self.min_length <= len(value) <= self.max_length):
+            return self.length_message.format(label=label)
+        if self.pattern is not None and self.pattern.fullmatch(value) is None:
+            return self.pattern_message.format(label=label)
+        return None
+
+
+NAME = Rule(re.compile(r"[A-Za-z]+"), "{label} can only contain letters",
+            2, 20, "{label} must be 2-20 characters long")
+PASSWORD = Rule(re.compile(r"(?=.*[A-Za-z])(?=.*\d)[A-Za-z\d@$!%*#?&]{6,20}"),
+                "Password must be 6-20 characters, include letters and numbers.",
+                6, 20, "Password must be between 6-20 characters")
+MOBILE = Rule(re.compile(r"[0-9]{10}"), "Mobile number must be exactly 10 digits.")
+USERNAME = Rule(re.compile(r"[A-Za-z0-9_]+"), "Username can only contain letters, numbers, and underscores.",
+                5, 15, "Username must be between 5-15 characters.")
+EMAIL = Rule(re.compile(r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}"), "Invalid email format.")
+# Only has to be present
+REQUIRED = Rule()
+
+
+class Schema:
+    """
+    Declarative schema for a form or import record. validate() checks every field in one pass and
+    returns all the errors together instead of raising on the first one.
+    Args:
+        fields (dict): Field name -> (label, Rule), checked in this order.
+        optional (tuple): Fields that may be left empty; they are checked only when given.
+        strip (bool): Strip surrounding whitespace (and convert non-string values to strings) first.
+    """
+
+    def __init__(self, fields: dict, optional: tuple = (), strip: bool = False):
+        self.strip = strip
+        # Messages are formatted once here, not on every call
+        self._fields = [
+            (name, name in optional, f"{label} is required", rule.min_length, rule.max_length,
+             rule.length_message.format(label=label) if rule.length_message else None,
+             rule.pattern.fullmatch if rule.pattern is not None else None,
+             rule.pattern_message.format(label=label) if rule.pattern_message else None)
+            for name, (label, rule) in fields.items()
+        ]
+
+    # (values, errors): the checked values and a field -> message dict, empty when everything is valid
+    def validate(self, data: dict):
+        values, errors = {}, {}
+        for name, optional, missing, low, high, length_message, match, pattern_message in self._fields:
+            value = data.get(name)
+            if self.strip and value is not None:
+                value = (value if isinstance(value, str) else str(value)).strip()
+            if not value:
+                if optional:
+                    values[name] = None
+                else:
+                    errors[name] = missing
+                continue
+            if high is not None and not (low <= len(value) <= high):
+                errors[name] = length_message
+            elif match is not None and match(value) is None:
+                errors[name] = pattern_message
+            else:
+                values[name] = value
+        return values, errors
+
+    # Only the errors of validate()
+    def errors(self, data: dict) -> dict:
+        return self.validate(data)[1]
+
+    # validate() for a whole batch of records
+    def validate_many(self, records) -> list:
+        validate = self.validate
+        return [validate(record) for record in records]
+
+
+USER_FIELDS = {
+    "first_name": ("First name", NAME),
+    "last_name": ("Last name", NAME),
+    "username": ("Username", USERNAME),
+    "email": ("Email", EMAIL),
+    "mobile": ("Mobile", MOBILE),
+    "password": ("Password", PASSWORD),
+}
+
+# Signup and add-user forms
+USER_FORM = Schema(USER_FIELDS)
+# Update form: the password is only changed when a new one is given
+UPDATE_FORM = Schema(USER_FIELDS, optional=("password",))
+
+
+# Single-field validators, raising HTTPException on the first problem
+def _check(rule: Rule, value: str):
+    message = rule.check(value)
+    if message:
+        raise HTTPException(status_code=400, detail=message)
+    return value
 
 def validate_name(name: str) -> bool:
-    if not (2 <= len(name) <= 20):
-        raise HTTPException(status_code=400, detail="It must be 2-20 characters long")
-    if not re.match(r"^[A-Za-z]+$", name):
-        raise HTTPException(status_code=400, detail="It can only contain letters")
-    return name
+    return _check(NAME, name)
 
 def validate_password(password: str) -> bool:
-    if not (6 <= len(password) <= 20):
-        raise HTTPException(status_code=400, detail="Password must be between 8-15 characters")
-    if not re.match(r"^(?=.*[A-Za-z])(?=.*\d)[A-Za-z\d@$!%*#?&]{6,20}$", password):
-        raise HTTPException(status_code=400, detail="Password must be 6-20 characters, include letters and numbers.")
-    return password
+    return _check(PASSWORD, password)
 
 def validate_mobile(mobile: str) -> bool:
-    if not re.match(r"^[0-9]{10}$", mobile):
-        raise HTTPException(status_code=400, detail="Mobile number must be exactly 10 digits.")
-    return mobile
+    return _check(MOBILE, mobile)
 
 def validate_username(username: str) -> bool:
-    if not (5 <= len(username) <= 15):
-        raise HTTPException(status_code=400, detail="Username must be between 5-15 characters.")
-    if not re.match(r"^[A-Za-z0-9_]+$", username):
-        raise HTTPException(status_code=400, detail="Username can only contain letters, numbers, and underscores.")
-    return username
+    return _check(USERNAME, username)
 
 def validate_email(email: str) -> bool:
-    if not re.match(r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$", email):
-        raise HTTPException(status_code=400, detail="Invalid email format.")
-    return email
\ No newline at end of file
+    return _check(EMAIL, email)